@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+JSON HTTP API for the exposure model, served by the Dash app's Flask server.
+
+    POST /api/scenarios
+    {"scenarios": [{"num_students": 20}, {"num_students": 40}],
+     "num_runs": 10000, "samples": false}
+
+The body may also be a single scenario object or a bare list of scenarios.
+Scenarios are update_df keyword arguments in the model's own units
+(fractions, not the percentages typed into the page); anything left out
+takes its default (GET /api/parameters lists them). Each result holds the
+mean and QUANTILES of PFsemester and PSsemester, plus the raw samples as
+zlib-compressed, base64-encoded float32 arrays when "samples" is true.
+
+Requests arriving within a few milliseconds of each other are coalesced by
+a background thread into vectorized sweep.evaluate calls. A request may ask
+for at most MAX_SAMPLES scenario-samples (MAX_RETURNED_SAMPLES when the
+samples are returned), a batch holds at most MAX_SAMPLES, and a batch is
+evaluated chunk_samples at a time, so memory stays bounded whatever the
+request.
+"""
+
+import base64
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+import numpy as np
+from flask import jsonify, request
+
+from model import INPUTS, OUTPUTS, QUANTILES
+from summary import describe
+from sweep import DEFAULTS, evaluate, stack_scenarios
+
+MAX_SCENARIOS = 10000
+MAX_RUNS = 100000
+#Scenarios x num_runs per request, and per request returning its samples
+MAX_SAMPLES = 10000000
+MAX_RETURNED_SAMPLES = 1000000
+
+class Coalescer(object):
+    """Merge concurrently submitted scenario lists into batched evaluations.
+
+    submit() blocks until the batch it joined has been evaluated. A batch
+    stops growing at max_scenarios scenarios or max_samples samples, and is
+    evaluated at most chunk_samples samples at a time. The worker thread is
+    started lazily per process, so it survives gunicorn's fork.
+    """
+    def __init__(self,max_wait=0.005,max_scenarios=4096,max_samples=MAX_SAMPLES,chunk_samples=500000):
+        self.max_wait = max_wait
+        self.max_scenarios = max_scenarios
+        self.max_samples = max_samples
+        self.chunk_samples = chunk_samples
+        self._pid = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run,daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self,scenarios,num_runs):
+        """Outputs for each scenario, as {output: (len(scenarios), num_runs)}."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((scenarios,num_runs,future))
+        return future.result()
+
+    def _collect(self):
+        #A request that would overflow the batch is held over for the next one
+        if self._pending is not None:
+            batch,self._pending = [self._pending],None
+        else:
+            batch = [self._queue.get()]
+        size = len(batch[0][0])
+        samples = size*batch[0][1]
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_scenarios and samples < self.max_samples:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0: break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(item[0]) > self.max_scenarios or samples + len(item[0])*item[1] > self.max_samples:
+                self._pending = item
+                break
+            batch.append(item)
+            size += len(item[0])
+            samples += len(item[0])*item[1]
+        return batch
+
+    def _evaluate(self,scenarios,num_runs):
+        #Outputs of every scenario, evaluated in chunks of at most chunk_samples
+        step = max(1,self.chunk_samples // num_runs)
+        outputs = {fld:np.empty((len(scenarios),num_runs)) for fld in OUTPUTS}
+        for start in range(0,len(scenarios),step):
+            result = evaluate(scenarios[start:start+step],num_runs)
+            for fld in OUTPUTS:
+                outputs[fld][start:start+step] = result[fld]
+        return outputs
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            for num_runs in set(item[1] for item in batch):
+                items = [item for item in batch if item[1] == num_runs]
+                try:
+                    result = self._evaluate([s for item in items for s in item[0]],num_runs)
+                except Exception as err:
+                    if len(items) == 1:
+                        items[0][2].set_exception(err)
+                        continue
+                    #Retry each request alone, so only the offending one fails
+                    for scenarios,_,future in items:
+                        try:
+                            future.set_result(self._evaluate(scenarios,num_runs))
+                        except Exception as item_err:
+                            future.set_exception(item_err)
+                    continue
+                start = 0
+                for scenarios,_,future in items:
+                    stop = start + len(scenarios)
+                    future.set_result({fld:result[fld][start:stop] for fld in OUTPUTS})
+                    start = stop
+
+coalescer = Coalescer()
+
+def encode_samples(values):
+    values = np.ascontiguousarray(values,dtype=np.float32)
+    return {'dtype':'float32','shape':list(values.shape),'encoding':'zlib+base64',
+            'data':base64.b64encode(zlib.compress(values.tobytes())).decode('ascii')}
+
+def _parse(body):
+    if isinstance(body,list):
+        return body,{}
+    if isinstance(body,dict) and 'scenarios' in body:
+        return body['scenarios'],body
+    if isinstance(body,dict):
+        return [body],{}
+    raise ValueError('body must be a scenario, a list of scenarios or {"scenarios": [...]}')
+
+def check_ranges(scenarios):
+    """Raise ValueError for a [min, max] range with min > max, or a
+    [mean, sd] range with sd < 0."""
+    kinds = {param:kind for _,kind,param in INPUTS}
+    for i,scenario in enumerate(scenarios):
+        for name,value in scenario.items():
+            if kinds.get(name) == 'uniform' and value[0] > value[1]:
+                raise ValueError(f'{name} (scenario {i}): min must not exceed max')
+            if kinds.get(name) == 'normal' and value[1] < 0:
+                raise ValueError(f'{name} (scenario {i}): sd must not be negative')
+
+def _error(message,status=400):
+    response = jsonify({'error':message})
+    response.status_code = status
+    return response
+
+def scenarios_view():
+    try:
+        scenarios,options = _parse(request.get_json(force=True,silent=True))
+        num_runs = int(options.get('num_runs',10000))
+        with_samples = bool(options.get('samples',False))
+        if not isinstance(scenarios,list) or not all(isinstance(s,dict) for s in scenarios):
+            raise ValueError('scenarios must be a list of objects')
+        if not 0 < len(scenarios) <= MAX_SCENARIOS:
+            raise ValueError(f'between 1 and {MAX_SCENARIOS} scenarios are allowed')
+        if not 0 < num_runs <= MAX_RUNS:
+            raise ValueError(f'num_runs must be between 1 and {MAX_RUNS}')
+        limit = MAX_RETURNED_SAMPLES if with_samples else MAX_SAMPLES
+        if len(scenarios)*num_runs > limit:
+            raise ValueError(f'scenarios x num_runs may be at most {limit}'
+                             + (' when samples are returned' if with_samples else ''))
+        stack_scenarios(scenarios)
+        check_ranges(scenarios)
+    except (TypeError,ValueError) as err:
+        return _error(str(err))
+    outputs = coalescer.submit(scenarios,num_runs)
+    results = []
+    for i in range(len(scenarios)):
+        entry = {}
+        for fld in OUTPUTS:
+            stats = describe(outputs[fld][i],QUANTILES)
+            entry[fld] = {'mean':stats['mean'],
+                          'quantiles':{f'{q:g}':float(v) for q,v in zip(QUANTILES,stats['quantiles'])}}
+        if with_samples:
+            entry['samples'] = {fld:encode_samples(outputs[fld][i]) for fld in OUTPUTS}
+        results.append(entry)
+    return jsonify({'num_runs':num_runs,'results':results})
+
+def parameters_view():
+    return jsonify(DEFAULTS)
+
+def register(server,prefix='/api'):
+    """Add the API routes to a Flask app (the Dash app's `server`)."""
+    server.add_url_rule(f'{prefix}/scenarios','api_scenarios',scenarios_view,methods=['POST'])
+    server.add_url_rule(f'{prefix}/parameters','api_parameters',parameters_view,methods=['GET'])
+    return server
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Score a whole course catalog with the exposure model.
+
+    python batch.py catalog.csv results.csv --params policy.json
+
+The catalog (CSV or Parquet) has one row per section. Columns named like
+update_df arguments (surface_area, height, num_students, duration,
+num_class_periods, ...) set that argument for the section; uncertain
+ranges can be given as <argument>_min / <argument>_max columns. Anything
+not in the catalog comes from the policy JSON file of update_df keyword
+arguments, and then from the update_df defaults.
+
+Sections are streamed through the model `--chunk-size` at a time, and each
+chunk's summaries (mean and QUANTILES of both outputs) are appended to the
+output as soon as they are computed: a CSV file, or a directory of Parquet
+part files for a .parquet output. Progress is recorded next to the output,
+so an interrupted run picks up where it stopped when rerun with the same
+arguments. Each chunk is seeded from --seed and its position, so resumed
+and uninterrupted runs give identical results.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from sweep import DEFAULTS, evaluate, summarize
+
+#%% Catalog
+def _is_parquet(path):
+    return path.endswith(('.parquet','.pq'))
+
+def read_catalog(path,chunk_size,skip=0):
+    """Yield the catalog as DataFrames of exactly chunk_size rows (bar the last)."""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        frames = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        frames = pd.read_csv(path,chunksize=chunk_size)
+    pending = []
+    pending_rows = 0
+    for frame in frames:
+        if skip:
+            dropped = min(skip,len(frame))
+            frame = frame.iloc[dropped:]
+            skip -= dropped
+        pending.append(frame)
+        pending_rows += len(frame)
+        while pending_rows >= chunk_size:
+            data = pd.concat(pending,ignore_index=True)
+            yield data.iloc[:chunk_size]
+            pending = [data.iloc[chunk_size:]]
+            pending_rows = len(pending[0])
+    if pending_rows:
+        yield pd.concat(pending,ignore_index=True)
+
+def section_scenarios(frame,policy):
+    """update_df keyword arguments for each row of a catalog chunk."""
+    scenarios = []
+    for row in frame.to_dict('records'):
+        scenario = dict(policy)
+        for name,default in DEFAULTS.items():
+            if isinstance(default,list):
+                low,high = row.get(f'{name}_min'),row.get(f'{name}_max')
+                if pd.notna(low) and pd.notna(high): scenario[name] = [low,high]
+            elif pd.notna(row.get(name)):
+                scenario[name] = row[name]
+        scenarios.append(scenario)
+    return scenarios
+
+#%% Output
+class _Progress(object):
+    """Rows and bytes written so far, kept in <output>.progress.json."""
+    def __init__(self,output,settings):
+        self.path = output + '.progress.json'
+        self.settings = settings
+        self.rows = 0
+        self.bytes = 0
+
+    def load(self):
+        if not os.path.exists(self.path): return self
+        with open(self.path) as f:
+            state = json.load(f)
+        if state['settings'] != self.settings:
+            raise SystemExit(f'{self.path} was written with different settings; '
+                             'rerun with --restart to start over')
+        self.rows = state['rows']
+        self.bytes = state['bytes']
+        return self
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp,'w') as f:
+            json.dump({'settings':self.settings,'rows':self.rows,'bytes':self.bytes},f)
+        os.replace(tmp,self.path)
+
+    def clear(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+def _append_csv(output,table,progress):
+    with open(output,'ab' if progress.bytes else 'wb') as f:
+        f.truncate(progress.bytes)
+        f.seek(progress.bytes)
+        table.to_csv(f,header=progress.bytes == 0,index=False)
+        f.flush()
+        os.fsync(f.fileno())
+        progress.bytes = f.tell()
+
+def _append_parquet(output,table,progress,chunk_index):
+    os.makedirs(output,exist_ok=True)
+    part = os.path.join(output,f'part-{chunk_index:06d}.parquet')
+    table.to_parquet(part + '.tmp',index=False)
+    os.replace(part + '.tmp',part)
+
+#%% Runner
+def run_batch(catalog,output,policy=None,num_runs=10000,chunk_size=64,
+              seed=0,id_column='section_id',restart=False,log=None):
+    """Score every section of `catalog` and write summaries to `output`.
+
+    Returns the number of sections scored by this call.
+    """
+    policy = dict(policy or {})
+    settings = {'catalog':os.path.abspath(catalog),'policy':policy,'num_runs':num_runs,
+                'chunk_size':chunk_size,'seed':seed}
+    progress = _Progress(output,settings)
+    if restart:
+        progress.clear()
+        if _is_parquet(output) and os.path.isdir(output):
+            for name in os.listdir(output):
+                if name.startswith('part-'): os.remove(os.path.join(output,name))
+    progress.load()
+    scored = 0
+    chunk_index = progress.rows // chunk_size
+    for frame in read_catalog(catalog,chunk_size,skip=progress.rows):
+        rng = np.random.default_rng(np.random.SeedSequence(seed,spawn_key=(chunk_index,)))
+        summary = summarize(evaluate(section_scenarios(frame,policy),num_runs,random_state=rng))
+        ids = frame[id_column] if id_column in frame else progress.rows + np.arange(len(frame))
+        table = pd.DataFrame({id_column:np.asarray(ids)})
+        for key,values in summary.items():
+            table[key] = values
+        if _is_parquet(output): _append_parquet(output,table,progress,chunk_index)
+        else: _append_csv(output,table,progress)
+        progress.rows += len(frame)
+        progress.save()
+        scored += len(frame)
+        chunk_index += 1
+        if log: log(f'{progress.rows} sections scored')
+    return scored
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score a course catalog with the classroom exposure model.')
+    parser.add_argument('catalog',help='CSV or Parquet file, one row per section')
+    parser.add_argument('output',help='CSV file, or .parquet directory of part files')
+    parser.add_argument('--params',help='JSON file of update_df keyword arguments applied to every section')
+    parser.add_argument('--num-runs',type=int,default=10000,help='Monte Carlo samples per section')
+    parser.add_argument('--chunk-size',type=int,default=64,help='sections evaluated together')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--id-column',default='section_id')
+    parser.add_argument('--restart',action='store_true',help='ignore earlier progress and start over')
+    args = parser.parse_args(argv)
+    policy = {}
+    if args.params:
+        with open(args.params) as f:
+            policy = json.load(f)
+    scored = run_batch(args.catalog,args.output,policy,args.num_runs,args.chunk_size,
+                       args.seed,args.id_column,args.restart,
+                       log=lambda msg: print(msg,file=sys.stderr))
+    print(f'{scored} sections scored',file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks and performance regression checks for the model and the app.
+
+    python bench.py --save bench_baseline.json      # record a baseline
+    python bench.py --check bench_baseline.json     # exit 1 if slower
+
+Micro-benchmarks time each stage (run_model, update_df, summaries,
+update_figure and the update_page callback) at several sample counts and
+record the tracemalloc high-water mark of one call. The load test drives
+the Dash callback endpoint through Flask's test client from `workers`
+processes with `threads` threads each -- by default the configuration in
+config.py -- and reports p50/p95/p99 latency and throughput. With --http
+each configuration is instead served by a real gunicorn (config.py with
+GUNICORN_PROCESSES/GUNICORN_THREADS set) and loaded over HTTP, and the
+server's memory (proportional set size, on Linux) and throughput per GB
+are reported too. Results are written as JSON so later runs can be
+compared against them.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+import numpy as np
+
+SIZES = (10000,100000,1000000)
+
+#%% Micro-benchmarks
+def _time(func,min_time=0.5,max_repeat=50):
+    #Median and best of as many calls as fit in min_time (at least 3)
+    times = []
+    started = time.perf_counter()
+    while len(times) < 3 or (time.perf_counter() - started < min_time and len(times) < max_repeat):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return {'median':statistics.median(times),'best':min(times),'repeat':len(times)}
+
+def _peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def micro_benchmarks(sizes=SIZES,min_time=0.5):
+    import wsgi
+    from cache import ResultCache
+    from model import run_model, update_df
+    from summary import describe_outputs
+    rs = np.random.RandomState(0)
+    stages = {'update_df[n=10000]':update_df}
+    for n in sizes:
+        result = run_model(num_runs=n,random_state=rs)
+        stages[f'run_model[n={n}]'] = lambda n=n: run_model(num_runs=n,random_state=rs)
+        stages[f'summarize_output[n={n}]'] = lambda r=result: (wsgi.summarize_output(r,True),
+                                                                 wsgi.summarize_output(r,False))
+        stages[f'describe_outputs[n={n}]'] = lambda r=result: describe_outputs(r)
+        stages[f'update_figure[n={n}]'] = lambda r=result: wsgi.update_figure(r).to_json()
+    values = wsgi.layout_values(wsgi.app.layout)
+    args = [values[state.component_id] for state in wsgi.page_states]
+    def page():
+        #Callback with the result cache bypassed, so the model always runs
+        cached,wsgi.results_cache = wsgi.results_cache,ResultCache(maxsize=0)
+        try:
+            wsgi.update_page(1,0,None,None,10000,*args)
+        finally:
+            wsgi.results_cache = cached
+    stages['update_page[n=10000]'] = page
+    results = {}
+    for name,func in stages.items():
+        func()
+        results[name] = dict(_time(func,min_time),peak_bytes=_peak(func))
+    return results
+
+#%% Load test
+def _callback_payload(values,click,num_runs=10000,user=None):
+    outputs = [{'id':'faculty_results','property':'children'},
+               {'id':'student_results','property':'children'},
+               {'id':'results_text','property':'children'},
+               {'id':'job_status','property':'children'},
+               {'id':'job','property':'data'},
+               {'id':'user','property':'data'},
+               {'id':'job-poll','property':'disabled'}]
+    return {'output':'..' + '...'.join(f"{o['id']}.{o['property']}" for o in outputs) + '..',
+            'outputs':outputs,
+            'inputs':[{'id':'submit-button-state','property':'n_clicks','value':click},
+                      {'id':'job-poll','property':'n_intervals','value':0}],
+            'changedPropIds':['submit-button-state.n_clicks'],
+            'state':[{'id':'job','property':'data','value':None},
+                     {'id':'user','property':'data','value':user},
+                     {'id':'num_runs','property':'value','value':num_runs}] +
+                    [{'id':state.component_id,'property':'value','value':value}
+                     for state,value in values]}
+
+def _load_worker(threads,requests,unique,offset,queue):
+    import wsgi
+    values = wsgi.layout_values(wsgi.app.layout)
+    states = [(state,values[state.component_id]) for state in wsgi.page_states]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    def run(thread):
+        #Each thread is one browser, with its own incremental model session
+        client = wsgi.application.test_client()
+        user = {'id':f'bench-{offset}-{thread}'}
+        for i in range(requests):
+            page = list(states)
+            if unique:
+                #Vary the floor area so every request misses the result cache
+                page[0] = (page[0][0],page[0][1] + (offset + thread*requests + i)*1e-6)
+            t = time.perf_counter()
+            response = client.post('/_dash-update-component',json=_callback_payload(page,1,user=user))
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200: errors.append(response.status_code)
+    started = time.perf_counter()
+    pool = [threading.Thread(target=run,args=(t,)) for t in range(threads)]
+    for t in pool: t.start()
+    for t in pool: t.join()
+    queue.put((latencies,errors,time.perf_counter() - started))
+
+def load_test(workers,threads,requests=50,unique=True):
+    """Latency percentiles and throughput of the page callback."""
+    ctx = multiprocessing.get_context('fork' if sys.platform != 'win32' else 'spawn')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_load_worker,args=(threads,requests,unique,w*threads*requests,queue))
+             for w in range(workers)]
+    for p in procs: p.start()
+    parts = [queue.get() for _ in procs]
+    for p in procs: p.join()
+    latencies = np.concatenate([part[0] for part in parts])
+    wall = max(part[2] for part in parts)
+    p50,p95,p99 = np.percentile(latencies,[50,95,99])
+    return {'requests':int(latencies.size),'errors':sum(len(part[1]) for part in parts),
+            'p50':p50,'p95':p95,'p99':p99,
+            'throughput':latencies.size / wall,
+            'throughput_per_worker':latencies.size / wall / workers}
+
+#%% HTTP load test
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+def _memory_bytes(pid):
+    #Proportional set size of a process tree: shared copy-on-write pages are
+    #split between the processes sharing them, so the sum is the real total
+    total = 0
+    for p in [pid] + _children(pid):
+        try:
+            with open(f'/proc/{p}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            return None
+    return total
+
+def http_load_test(workers,threads,requests=50,concurrency=8,port=8765,timeout=120):
+    """Latency, throughput and memory of a gunicorn server over HTTP.
+
+    `concurrency` client threads each send `requests` page callbacks.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ,GUNICORN_PROCESSES=str(workers),GUNICORN_THREADS=str(threads))
+    server = subprocess.Popen([sys.executable,'-m','gunicorn','-c','config.py','--bind',f'127.0.0.1:{port}',
+                               'wsgi:application'],cwd=here,env=env,
+                              stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                urllib.request.urlopen(url + '/_dash-layout',timeout=5).read()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError(f'gunicorn {workers}x{threads} did not start')
+                time.sleep(0.2)
+        import wsgi
+        values = wsgi.layout_values(wsgi.app.layout)
+        states = [(state,values[state.component_id]) for state in wsgi.page_states]
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        def run(thread):
+            user = {'id':f'bench-http-{thread}'}
+            for i in range(requests):
+                page = list(states)
+                page[0] = (page[0][0],page[0][1] + (thread*requests + i)*1e-6)
+                body = json.dumps(_callback_payload(page,1,user=user)).encode()
+                request = urllib.request.Request(url + '/_dash-update-component',data=body,
+                                                 headers={'Content-Type':'application/json'})
+                t = time.perf_counter()
+                try:
+                    urllib.request.urlopen(request,timeout=timeout).read()
+                    ok = True
+                except OSError:
+                    ok = False
+                elapsed = time.perf_counter() - t
+                with lock:
+                    latencies.append(elapsed)
+                    if not ok: errors.append(i)
+        started = time.perf_counter()
+        pool = [threading.Thread(target=run,args=(t,)) for t in range(concurrency)]
+        for t in pool: t.start()
+        for t in pool: t.join()
+        wall = time.perf_counter() - started
+        memory = _memory_bytes(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = np.asarray(latencies)
+    p50,p95,p99 = np.percentile(latencies,[50,95,99])
+    throughput = latencies.size / wall
+    return {'requests':int(latencies.size),'errors':len(errors),
+            'p50':p50,'p95':p95,'p99':p99,'throughput':throughput,
+            'memory_bytes':memory,
+            'throughput_per_gb':None if not memory else throughput / (memory / 2**30)}
+
+#%% Baselines
+def check(results,baseline,tolerance=0.25):
+    """Regressions of `results` against `baseline`, as readable messages."""
+    failures = []
+    for name,base in baseline.get('micro',{}).items():
+        new = results.get('micro',{}).get(name)
+        if new is None: continue
+        for key in ('median','peak_bytes'):
+            if new[key] > base[key] * (1 + tolerance):
+                failures.append(f'{name} {key}: {new[key]:.4g} vs baseline {base[key]:.4g}')
+    for name,base in baseline.get('load',{}).items():
+        new = results.get('load',{}).get(name)
+        if new is None: continue
+        if new['p95'] > base['p95'] * (1 + tolerance):
+            failures.append(f'load {name} p95: {new["p95"]:.4g}s vs baseline {base["p95"]:.4g}s')
+        if new['throughput'] < base['throughput'] / (1 + tolerance):
+            failures.append(f'load {name} throughput: {new["throughput"]:.4g}/s vs baseline {base["throughput"]:.4g}/s')
+        if new['errors']:
+            failures.append(f'load {name}: {new["errors"]} failed requests')
+    return failures
+
+def _configs(text):
+    #"3x1,1x4" -> [(3, 1), (1, 4)]; defaults to the gunicorn settings in config.py
+    if not text:
+        import config
+        return [(config.workers,config.threads)]
+    return [tuple(int(v) for v in item.split('x')) for item in text.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the exposure model and web callback.')
+    parser.add_argument('--sizes',default=','.join(str(n) for n in SIZES),help='sample counts for the micro-benchmarks')
+    parser.add_argument('--min-time',type=float,default=0.5,help='seconds spent timing each stage')
+    parser.add_argument('--configs',help='load-test configurations as WORKERSxTHREADS[,...] (default: config.py)')
+    parser.add_argument('--requests',type=int,default=50,help='requests per load-test thread')
+    parser.add_argument('--cached',action='store_true',help='repeat identical requests (result cache hits)')
+    parser.add_argument('--http',action='store_true',help='load a real gunicorn server over HTTP and measure its memory')
+    parser.add_argument('--concurrency',type=int,default=8,help='client threads for --http')
+    parser.add_argument('--skip-load',action='store_true')
+    parser.add_argument('--save',help='write results to this JSON file')
+    parser.add_argument('--check',help='compare with this baseline JSON file; exit 1 on regressions')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='allowed slowdown before --check fails')
+    args = parser.parse_args(argv)
+    results = {'meta':{'python':platform.python_version(),'numpy':np.__version__,
+                       'machine':platform.machine(),'processor':platform.processor()}}
+    results['micro'] = micro_benchmarks([int(n) for n in args.sizes.split(',')],args.min_time)
+    for name,r in results['micro'].items():
+        print(f'{name:34s} {r["median"]*1e3:10.3f} ms  peak {r["peak_bytes"]/2**20:8.2f} MiB')
+    if not args.skip_load:
+        results['load'] = {}
+        for workers,threads in _configs(args.configs):
+            if args.http:
+                r = http_load_test(workers,threads,args.requests,args.concurrency)
+            else:
+                r = load_test(workers,threads,args.requests,unique=not args.cached)
+            results['load'][f'{workers}x{threads}'] = r
+            print(f'load {workers}x{threads}: p50 {r["p50"]*1e3:.1f} ms  p95 {r["p95"]*1e3:.1f} ms  '
+                  f'p99 {r["p99"]*1e3:.1f} ms  {r["throughput"]:.1f} req/s  errors {r["errors"]}'
+                  + (f'  {r["memory_bytes"]/2**20:.0f} MiB  {r["throughput_per_gb"]:.0f} req/s/GB'
+                     if r.get('memory_bytes') else ''))
+    if args.save:
+        with open(args.save,'w') as f:
+            json.dump(results,f,indent=1)
+    if args.check:
+        with open(args.check) as f:
+            failures = check(results,json.load(f),args.tolerance)
+        for failure in failures: print('REGRESSION',failure)
+        if failures: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
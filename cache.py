@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Result cache for the exposure model, keyed on canonicalized inputs.
+
+Inputs are canonicalized (numbers as floats, ranges as tuples, keys
+sorted) and hashed; the hash also yields the random seed, so identical
+inputs always reproduce the same result. Results live in a bounded
+in-process LRU and, optionally, in a SQLite file shared by every gunicorn
+worker -- point it at /dev/shm to keep the shared copy in memory. The
+shared file holds JSON, never pickles, so whoever can write to it cannot
+make the workers run code; cached values (tuples of Markdown strings) must
+therefore be JSON-serializable, and come back with lists as tuples.
+"""
+
+import hashlib
+import json
+import numbers
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+#%% Keys and seeds
+def canonicalize(params):
+    """Hashable, order-independent form of a dict of model inputs."""
+    def canon(value):
+        if isinstance(value,(list,tuple)):
+            return tuple(canon(v) for v in value)
+        if isinstance(value,numbers.Real) and not isinstance(value,bool):
+            return float(value)
+        return value
+    return tuple(sorted((name,canon(value)) for name,value in params.items()))
+
+def cache_key(params):
+    return hashlib.sha256(repr(canonicalize(params)).encode()).hexdigest()
+
+def seed_for(key):
+    #32 bits of the key, the range accepted by np.random.RandomState
+    return int(key[:8],16)
+
+#%% Backends
+class MemoryBackend(object):
+    """Thread-safe LRU dict holding at most `maxsize` results."""
+    def __init__(self,maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self,key):
+        with self._lock:
+            if key not in self._data: return _MISSING
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self,key,value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class SQLiteBackend(object):
+    """Approximate LRU store in a SQLite file, shared by every process that
+    opens it.
+
+    Each thread keeps its own connection, reopened after gunicorn's fork.
+    The file is in WAL mode, so readers never wait for the writer, and a
+    hit only rewrites the entry's last-used time once per touch_interval
+    seconds: hot entries are read without taking the write lock, at the
+    cost of eviction order being that coarse.
+    """
+    def __init__(self,path,maxsize=1024,touch_interval=60):
+        self.path = path
+        self.maxsize = maxsize
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        con = self._connection()
+        con.execute('PRAGMA journal_mode=WAL')
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS results '
+                        '(key TEXT PRIMARY KEY, value BLOB, used REAL)')
+
+    def _connection(self):
+        local = self._local
+        if getattr(local,'pid',None) != os.getpid():
+            local.con = sqlite3.connect(self.path,timeout=30)
+            local.pid = os.getpid()
+        return local.con
+
+    def get(self,key):
+        con = self._connection()
+        row = con.execute('SELECT value, used FROM results WHERE key=?',(key,)).fetchone()
+        if row is None: return _MISSING
+        try:
+            value = json.loads(row[0])
+        except (TypeError,ValueError):
+            #e.g. a pickle left by an older version: treat as a miss
+            return _MISSING
+        now = time.time()
+        if now - row[1] > self.touch_interval:
+            with con:
+                con.execute('UPDATE results SET used=? WHERE key=?',(now,key))
+        return tuple(value) if isinstance(value,list) else value
+
+    def set(self,key,value):
+        text = json.dumps(value)
+        con = self._connection()
+        with con:
+            con.execute('INSERT OR REPLACE INTO results VALUES (?,?,?)',
+                        (key,text,time.time()))
+            con.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                        'ORDER BY used DESC LIMIT -1 OFFSET ?)',(self.maxsize,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+#%% Cache
+class ResultCache(object):
+    """In-process LRU in front of an optional shared SQLite store."""
+    def __init__(self,maxsize=128,path=None,shared_maxsize=1024):
+        self.memory = MemoryBackend(maxsize)
+        self.shared = SQLiteBackend(path,shared_maxsize) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._count_lock = threading.Lock()
+
+    def peek(self,key,default=None):
+        """Value stored under `key` (see cache_key), or default."""
+        value = self.memory.get(key)
+        if value is _MISSING and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not _MISSING: self.memory.set(key,value)
+        return default if value is _MISSING else value
+
+    def get(self,key,default=None):
+        """peek(), counting the lookup as a hit or a miss."""
+        value = self.peek(key,_MISSING)
+        with self._count_lock:
+            if value is _MISSING: self.misses += 1
+            else: self.hits += 1
+        return default if value is _MISSING else value
+
+    def set(self,key,value):
+        self.memory.set(key,value)
+        if self.shared is not None: self.shared.set(key,value)
+
+    def get_or_compute(self,params,compute):
+        """Return the cached value for `params`, or compute(seed) and store it."""
+        key = cache_key(params)
+        value = self.get(key,_MISSING)
+        if value is _MISSING:
+            value = compute(seed_for(key))
+            self.set(key,value)
+        return value
+
+def from_environ(environ=os.environ):
+    """ResultCache configured from RESULT_CACHE_SIZE / RESULT_CACHE_PATH."""
+    return ResultCache(maxsize=int(environ.get('RESULT_CACHE_SIZE','128')),
+                       path=environ.get('RESULT_CACHE_PATH') or None,
+                       shared_maxsize=int(environ.get('RESULT_CACHE_SHARED_SIZE','1024')))
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Combined semester infection risk of every student and instructor on campus.
+
+    python campus.py sections.csv enrollment.csv students.csv \\
+        --instructors-output instructors.csv --params policy.json
+
+The model gives the semester risk of one course. A person escapes infection
+over the semester only by escaping it in each of their sections. So, for a
+given Monte Carlo sample, survival probabilities multiply:
+
+    1 - P_person = prod over their sections s of (1 - P_s)
+
+In log-survival space this is a sum. For an enrollment matrix E (people x
+sections, 1 where the person attends) and the sections' log survivals LS
+(sections x samples), every person's combined risk in every sample is
+1 - exp(E @ LS). That is one sparse-dense matrix product, done with
+scipy.sparse when it is installed and with NumPy gathers and reduceat
+otherwise. People are processed block_size at a time, so memory grows with
+sections x samples rather than people x samples.
+
+Students take each section's PSsemester and instructors its PFsemester.
+Each Monte Carlo sample is one possible state of the campus, so inputs
+that describe the virus, the people or the community are drawn once per
+sample and shared by every section (common random numbers): decay rate,
+quanta emission rates, mask efficiencies, breathing rates and background
+infection rates (SHARED_INPUTS). Only the room's own ventilation,
+deposition and additional control measures are drawn independently per
+section. Treating the shared inputs as independent per section would bias
+each person's mean risk and narrow its quantiles. Shared draws are seeded
+from --seed, and each chunk's per-section draws from --seed and the
+chunk's position, as in batch.py.
+
+The sections file is a catalog as read by batch.py: one row per section,
+with update_df arguments as columns and an id column. The enrollment file
+has person, section and (optionally) role columns, where role is 'student'
+(the default) or 'instructor'.
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from model import INPUTS, QUANTILES
+from sweep import evaluate
+
+#Uncertain inputs (model.INPUTS columns) drawn once per sample for the whole
+#campus; the rest are properties of the room, drawn per section
+SHARED_INPUTS = ('DECAY','EFFOUT','EMMFx','EMMSx','INFRATEF','INFRATES','EFFIN','BRFx','BRSx')
+
+#%% Enrollment
+class Enrollment(object):
+    """People x sections incidence matrix in compressed sparse row form.
+
+    people holds the person ids (one per row). Row i attends the sections
+    indices[indptr[i]:indptr[i+1]], which are positions in the sections
+    list the Enrollment was built with.
+    """
+    def __init__(self,people,indptr,indices,num_sections):
+        self.people = people
+        self.indptr = indptr
+        self.indices = indices
+        self.num_sections = num_sections
+
+    @classmethod
+    def from_pairs(cls,person_ids,section_ids,sections):
+        """Enrollment from parallel arrays of (person id, section id) pairs.
+
+        sections lists every section id, in the row order of the section
+        outputs. Duplicate pairs count once.
+        """
+        person_ids = np.asarray(person_ids)
+        section_ids = np.asarray(section_ids)
+        sections = np.asarray(sections)
+        order = np.argsort(sections,kind='stable')
+        pos = np.searchsorted(sections,section_ids,sorter=order)
+        pos = np.minimum(pos,len(sections)-1)
+        found = sections[order[pos]] == section_ids
+        if not found.all():
+            missing = np.unique(section_ids[~found])[:5]
+            raise ValueError(f'enrollment refers to unknown sections, e.g. {list(missing)}')
+        cols = order[pos]
+        people,rows = np.unique(person_ids,return_inverse=True)
+        pairs = np.unique(rows.astype(np.int64)*len(sections) + cols)
+        rows,cols = np.divmod(pairs,len(sections))
+        indptr = np.zeros(len(people)+1,dtype=np.int64)
+        np.cumsum(np.bincount(rows,minlength=len(people)),out=indptr[1:])
+        return cls(people,indptr,cols,len(sections))
+
+    def __len__(self):
+        return len(self.people)
+
+    def counts(self):
+        """Number of sections each person attends."""
+        return np.diff(self.indptr)
+
+    def matrix(self):
+        """The enrollment as a scipy.sparse CSR matrix."""
+        from scipy import sparse
+        data = np.ones(len(self.indices))
+        return sparse.csr_matrix((data,self.indices,self.indptr),shape=(len(self),self.num_sections))
+
+#%% Combination
+def section_log_survival(scenarios,num_runs=1000,seed=None,chunk_size=256,dtype=np.float64):
+    """log(1-P) of each section (rows) and sample (columns), for both outputs.
+
+    scenarios are update_df keyword arguments, one per section. SHARED_INPUTS
+    use the same unit draws in every section. Returns {'PFsemester': array,
+    'PSsemester': array}, each (sections, num_runs).
+    """
+    scenarios = list(scenarios)
+    shared = [j for j,(name,_,_) in enumerate(INPUTS) if name in SHARED_INPUTS]
+    local = [j for j in range(len(INPUTS)) if j not in shared]
+    root = np.random.SeedSequence(seed)
+    shared_u = np.random.default_rng(root).random((num_runs,len(shared)))
+    out = {fld:np.empty((len(scenarios),num_runs),dtype=dtype) for fld in ('PFsemester','PSsemester')}
+    for index,start in enumerate(range(0,len(scenarios),chunk_size)):
+        rng = np.random.default_rng(np.random.SeedSequence(root.entropy,spawn_key=(index,)))
+        chunk = scenarios[start:start+chunk_size]
+        u = np.empty((len(chunk),num_runs,len(INPUTS)))
+        u[...,shared] = shared_u
+        u[...,local] = rng.random((len(chunk),num_runs,len(local)))
+        result = evaluate(chunk,num_runs,dtype=dtype,sampling=u)
+        for fld,arr in out.items():
+            np.negative(result[fld],out=arr[start:start+len(chunk)])
+            np.log1p(arr[start:start+len(chunk)],out=arr[start:start+len(chunk)])
+    return out
+
+def combined_log_survival(enrollment,log_survival,start=0,stop=None,matrix=None):
+    """Log survival of people start:stop over every sample, (people, samples).
+
+    matrix is enrollment.matrix(), if already built; without scipy the
+    product is done with NumPy.
+    """
+    stop = len(enrollment) if stop is None else min(stop,len(enrollment))
+    if matrix is None:
+        try:
+            matrix = enrollment.matrix()
+        except ImportError:
+            matrix = False
+    if matrix is not False:
+        return np.asarray(matrix[start:stop] @ log_survival)
+    out = np.zeros((stop-start,log_survival.shape[1]),dtype=log_survival.dtype)
+    lo,hi = enrollment.indptr[start],enrollment.indptr[stop]
+    counts = np.diff(enrollment.indptr[start:stop+1])
+    attends = counts > 0
+    if hi > lo:
+        #Sum each person's rows of the gathered sections (reduceat skips nobody
+        #because people without sections are left out)
+        gathered = log_survival[enrollment.indices[lo:hi]]
+        offsets = (enrollment.indptr[start:stop] - lo)[attends]
+        out[attends] = np.add.reduceat(gathered,offsets,axis=0)
+    return out
+
+def person_risk(enrollment,log_survival,quantiles=QUANTILES,block_size=1024):
+    """Mean and quantiles of each person's combined semester risk.
+
+    Returns a dict of arrays keyed 'mean' and 'q<q>', one value per person
+    (in enrollment.people order), plus 'sections' (sections attended).
+    """
+    try:
+        matrix = enrollment.matrix()
+    except ImportError:
+        matrix = False
+    n = len(enrollment)
+    out = {'sections':enrollment.counts(),'mean':np.empty(n)}
+    for q in quantiles: out[f'q{q:g}'] = np.empty(n)
+    for start in range(0,n,block_size):
+        stop = min(start+block_size,n)
+        risk = combined_log_survival(enrollment,log_survival,start,stop,matrix)
+        np.expm1(risk,out=risk); np.negative(risk,out=risk)
+        out['mean'][start:stop] = risk.mean(axis=1)
+        for q,values in zip(quantiles,np.quantile(risk,quantiles,axis=1)):
+            out[f'q{q:g}'][start:stop] = values
+    return out
+
+def campus_risk(scenarios,students,instructors=None,num_runs=1000,seed=None,
+                quantiles=QUANTILES,block_size=1024):
+    """person_risk of students (PSsemester) and instructors (PFsemester).
+
+    students and instructors are Enrollments over the sections in
+    `scenarios` order. Returns {'students': ..., 'instructors': ...}.
+    """
+    log_survival = section_log_survival(scenarios,num_runs,seed)
+    results = {'students':person_risk(students,log_survival['PSsemester'],quantiles,block_size)}
+    if instructors is not None:
+        results['instructors'] = person_risk(instructors,log_survival['PFsemester'],quantiles,block_size)
+    return results
+
+#%% Command line
+def _read_table(path):
+    import pandas as pd
+    if path.endswith(('.parquet','.pq')): return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def _write_risk(path,enrollment,risk,id_column):
+    import pandas as pd
+    table = pd.DataFrame({id_column:enrollment.people})
+    for key,values in risk.items():
+        table[key] = values
+    if path.endswith(('.parquet','.pq')): table.to_parquet(path,index=False)
+    else: table.to_csv(path,index=False)
+
+def main(argv=None):
+    from batch import section_scenarios
+    parser = argparse.ArgumentParser(description='Combined semester infection risk of every student and instructor.')
+    parser.add_argument('sections',help='CSV or Parquet catalog, one row per section')
+    parser.add_argument('enrollment',help='CSV or Parquet file of person, section[, role] rows')
+    parser.add_argument('output',help='CSV or Parquet file for the students')
+    parser.add_argument('--instructors-output',help='CSV or Parquet file for the instructors')
+    parser.add_argument('--params',help='JSON file of update_df keyword arguments applied to every section')
+    parser.add_argument('--num-runs',type=int,default=1000,help='Monte Carlo samples per section')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--id-column',default='section_id',help='section id column of the catalog')
+    parser.add_argument('--person-column',default='person')
+    parser.add_argument('--section-column',default='section')
+    parser.add_argument('--role-column',default='role')
+    parser.add_argument('--block-size',type=int,default=1024,help='people combined at a time')
+    args = parser.parse_args(argv)
+    policy = {}
+    if args.params:
+        with open(args.params) as f:
+            policy = json.load(f)
+    catalog = _read_table(args.sections)
+    scenarios = section_scenarios(catalog,policy)
+    sections = np.asarray(catalog[args.id_column])
+    enrollment = _read_table(args.enrollment)
+    role = (enrollment[args.role_column].fillna('student') if args.role_column in enrollment
+            else np.full(len(enrollment),'student'))
+    role = np.asarray(role)
+    def pairs(kind):
+        rows = enrollment[role == kind]
+        return Enrollment.from_pairs(rows[args.person_column],rows[args.section_column],sections)
+    students = pairs('student')
+    instructors = pairs('instructor') if args.instructors_output else None
+    print(f'{len(sections)} sections, {len(students)} students',file=sys.stderr)
+    results = campus_risk(scenarios,students,instructors,args.num_runs,args.seed,block_size=args.block_size)
+    _write_risk(args.output,students,results['students'],args.person_column)
+    if instructors is not None:
+        _write_risk(args.instructors_output,instructors,results['instructors'],args.person_column)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental re-evaluation of the exposure model.
+
+The model is written as a graph of stages, each a function of update_df
+arguments and earlier stages. An IncrementalModel draws its unit random
+variates once, from a fixed seed, and keeps every stage's array. On the
+next evaluate() it recomputes only the stages downstream of the arguments
+that changed. Changing num_students reruns the last four stages, and a new
+room volume reruns the chain from the concentrations on.
+
+Because the variates are reused, every scenario evaluated by one model
+sees the same random draws (common random numbers). Differences between
+scenarios are therefore far less noisy than with independent runs. The
+draws are those of run_model with np.random.RandomState(seed), and the
+stages follow its reference pipeline, so results match
+run_model(kernel='reference') exactly.
+
+Sessions keeps one model per session id (e.g. the page's user id) in a
+small LRU, so each user's what-if edits stay incremental.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from cache import canonicalize
+from metrics import INCREMENTAL_SAMPLES, stage
+from model import INPUTS, ModelResult, OUTPUTS
+from sweep import DEFAULTS
+
+#%% Stage graph
+def _uniform(var,u):
+    return var[0] + (var[1]-var[0])*u
+
+def _normal(var,z):
+    return var[0] + var[1]*z
+
+def _loss(VENT,DECAY,DEP,OTHER):
+    return VENT + DECAY + DEP + OTHER
+
+def _concentration_factor(L,duration,surface_area,height,EFFOUT):
+    #(1-EFFOUT)/(L*VOL)*(1-1/LDUR*(1-exp(-LDUR)))
+    VOL = surface_area * height*0.305**3
+    LDUR = L*(duration/60)
+    return (1-EFFOUT)/L/VOL*(np.expm1(-LDUR)/LDUR + 1)
+
+def _dose(CONC,BR,D):
+    return CONC*BR*D
+
+def _probability(dose,rate):
+    return -np.expm1(-dose)*rate
+
+#Stage name: (function, arguments); arguments are update_df parameters or
+#earlier stages. The inputs come first, each reading its unit variate
+#('U_<name>', drawn once per model).
+STAGES = OrderedDict(
+    [(name,(_uniform if kind == 'uniform' else _normal,(param,'U_'+name))) for name,kind,param in INPUTS] + [
+    ('L',(_loss,('VENT','DECAY','DEP','OTHER'))),
+    ('C',(_concentration_factor,('L','duration','surface_area','height','EFFOUT'))),
+    ('CONCF',(lambda EMMFx,C: 10**EMMFx*C,('EMMFx','C'))),
+    ('CONCS',(lambda EMMSx,C: 10**EMMSx*C,('EMMSx','C'))),
+    ('D',(lambda EFFIN,duration: (1-EFFIN)*(duration/60),('EFFIN','duration'))),
+    ('BRF',(lambda BRFx: BRFx*60,('BRFx',))),
+    ('BRS',(lambda BRSx: BRSx*60,('BRSx',))),
+    ('PF_S',(lambda CONCS,BRF,D,INFRATES: _probability(_dose(CONCS,BRF,D),INFRATES),('CONCS','BRF','D','INFRATES'))),
+    ('PS_F',(lambda CONCF,BRS,D,INFRATEF: _probability(_dose(CONCF,BRS,D),INFRATEF),('CONCF','BRS','D','INFRATEF'))),
+    ('PS_S',(lambda CONCS,BRS,D,INFRATES: _probability(_dose(CONCS,BRS,D),INFRATES),('CONCS','BRS','D','INFRATES'))),
+    ('nPF',(lambda PF_S,num_students: (1-PF_S)**num_students,('PF_S','num_students'))),
+    ('nPS',(lambda PS_S,PS_F,num_students,num_faculty: (1-PS_S)**(num_students-1)*(1-PS_F)**num_faculty,
+            ('PS_S','PS_F','num_students','num_faculty'))),
+    ('PFsemester',(lambda nPF,num_class_periods: 1 - nPF**num_class_periods,('nPF','num_class_periods'))),
+    ('PSsemester',(lambda nPS,num_class_periods: 1 - nPS**num_class_periods,('nPS','num_class_periods'))),
+    ])
+
+def downstream(names):
+    """Stages that depend, directly or not, on any of `names`."""
+    affected = set(names)
+    for name,(_,deps) in STAGES.items():
+        if affected.intersection(deps): affected.add(name)
+    return [name for name in STAGES if name in affected]
+
+#%% Evaluation
+class IncrementalModel(object):
+    """Memoized stage graph over one fixed set of random variates."""
+    def __init__(self,num_runs=10000,seed=0,dtype=np.float64):
+        self.num_runs = num_runs
+        self.dtype = np.dtype(dtype)
+        #Same draws, in the same order, as run_model with RandomState(seed)
+        rs = np.random.RandomState(seed)
+        self.values = {}
+        for name,kind,_ in INPUTS:
+            u = rs.random_sample(num_runs) if kind == 'uniform' else rs.standard_normal(num_runs)
+            self.values['U_'+name] = u
+        self._signatures = {}
+        self._versions = {name:0 for name in self.values}
+        self.recomputed = []
+        self._lock = threading.Lock()
+
+    def _signature(self,deps,params):
+        #Stages (and variates) by version, update_df arguments by value
+        return tuple(self._versions[d] if d in self._versions else canonicalize({d:params[d]}) for d in deps)
+
+    def evaluate(self,**params):
+        """Outputs for update_df keyword arguments, as a ModelResult.
+
+        The names of the stages that had to be recomputed are left in
+        self.recomputed.
+        """
+        unknown = set(params) - set(DEFAULTS)
+        if unknown: raise TypeError(f'unknown parameters: {sorted(unknown)}')
+        params = dict(DEFAULTS,**params)
+        with self._lock, stage('model.incremental'):
+            recomputed = []
+            for name,(func,deps) in STAGES.items():
+                signature = self._signature(deps,params)
+                if self._signatures.get(name) == signature: continue
+                args = [self.values[d] if d in self.values else params[d] for d in deps]
+                self.values[name] = np.asarray(func(*args),dtype=self.dtype)
+                self._signatures[name] = signature
+                self._versions[name] = self._versions.get(name,0) + 1
+                recomputed.append(name)
+            self.recomputed = recomputed
+            if recomputed: INCREMENTAL_SAMPLES.inc(self.num_runs)
+            columns = {fld:self.values[fld] for fld in OUTPUTS}
+        return ModelResult(columns,(self.num_runs,))
+
+class Sessions(object):
+    """LRU of IncrementalModels keyed on (session id, num_runs, seed)."""
+    def __init__(self,maxsize=16):
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def model(self,session,num_runs=10000,seed=0):
+        key = (session,num_runs,seed)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = IncrementalModel(num_runs,seed)
+            self._models.move_to_end(key)
+            while len(self._models) > self.maxsize:
+                self._models.popitem(last=False)
+        return model
+
+    def evaluate(self,session,num_runs=10000,seed=0,**params):
+        return self.model(session,num_runs,seed).evaluate(**params)
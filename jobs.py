@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Background jobs for Monte Carlo runs too large to compute within a request.
+
+A JobQueue runs jobs on a small thread pool. NumPy releases the GIL in its
+array loops, so the gunicorn worker keeps answering other requests while a
+job runs. A job is a function taking its Job. It calls job.report() as it
+goes (e.g. once per streaming.stream_model chunk) to publish progress and
+partial results, and to stop early once it has been cancelled.
+
+Submitting a job for a user cancels the job it supersedes, and a user may
+not have more than `per_user` jobs queued or running at once. Jobs live in
+the process that started them: pages polling for them should reach the
+same worker (one process with several threads, or sticky sessions), or
+find finished results in a shared result cache (RESULT_CACHE_PATH).
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class JobLimitError(RuntimeError):
+    pass
+
+class Cancelled(Exception):
+    #Raised inside a job by report() once it has been cancelled
+    pass
+
+class Job(object):
+    """State, progress and (partial) result of one background computation."""
+    def __init__(self,func,user=None):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.func = func
+        self.state = 'queued'
+        self.progress = 0.0
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def active(self):
+        return self.state in ('queued','running') and not self.cancelled
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self._finish('cancelled')
+
+    def report(self,progress,partial=None):
+        """Publish progress (0-1) and a partial result; raises Cancelled if cancelled."""
+        if self.cancelled: raise Cancelled()
+        self.progress = progress
+        if partial is not None: self.partial = partial
+
+    def _finish(self,state):
+        self.state = state
+        self.finished = time.time()
+
+    def run(self):
+        if self.cancelled:
+            self._finish('cancelled')
+            return
+        self.state = 'running'
+        try:
+            self.result = self.func(self)
+        except Cancelled:
+            self._finish('cancelled')
+        except Exception as err:
+            self.error = err
+            self._finish('failed')
+        else:
+            self.progress = 1.0
+            self._finish('done')
+
+class JobQueue(object):
+    """Thread-pool job queue with per-user limits.
+
+    The pool is created lazily per process, so a queue built before
+    gunicorn forks still works in every worker. Finished jobs are dropped
+    `ttl` seconds after they end.
+    """
+    def __init__(self,workers=2,per_user=2,ttl=600):
+        self.workers = workers
+        self.per_user = per_user
+        self.ttl = ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _executor(self):
+        if self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(self.workers,thread_name_prefix='job')
+            self._pid = os.getpid()
+            self.jobs = {}
+        return self._pool
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [i for i,job in self.jobs.items() if job.finished is not None and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self,func,user=None,supersedes=None):
+        """Queue func(job) and return the Job.
+
+        The job with id `supersedes` (the user's previous one) is cancelled
+        first. Raises JobLimitError if the user would exceed per_user.
+        """
+        with self._lock:
+            pool = self._executor()
+            self._prune()
+            old = self.jobs.get(supersedes)
+            if old is not None: old.cancel()
+            if user is not None and sum(job.user == user and job.active for job in self.jobs.values()) >= self.per_user:
+                raise JobLimitError(f'at most {self.per_user} calculations may run at once; '
+                                    'wait for one to finish')
+            job = Job(func,user)
+            self.jobs[job.id] = job
+            job.future = pool.submit(job.run)
+        return job
+
+    def get(self,job_id):
+        return self.jobs.get(job_id) if self._pid == os.getpid() else None
+
+    def cancel(self,job_id):
+        job = self.get(job_id)
+        if job is not None: job.cancel()
+        return job
+
+def from_environ(environ=os.environ):
+    """JobQueue configured from JOB_WORKERS / JOB_USER_LIMIT, or None if JOB_WORKERS=0."""
+    workers = int(environ.get('JOB_WORKERS','2'))
+    if workers < 1: return None
+    return JobQueue(workers=workers,per_user=int(environ.get('JOB_USER_LIMIT','2')))
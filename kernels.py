@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Fused kernels for the per-sample arithmetic of the exposure model.
+
+run_model's reference pipeline makes some forty whole-array passes over
+memory. A kernel takes the sampled inputs and returns only PFsemester and
+PSsemester, evaluating each sample's chain at once. The repeated powers
+become sums of logarithms,
+
+    1 - ((1-p)**n)**k  ->  -expm1(n*k*log1p(-p))
+
+which also keeps tiny probabilities accurate where 1-p rounds to 1.
+
+Backends:
+- 'numpy' fuses what NumPy can into in-place ufuncs over four buffers.
+- 'numba' compiles a single loop over samples. Numba is optional, and the
+  loop is compiled on first use or by warm_up(), which wsgi.warm_up calls
+  so that with preload_app it is compiled once in the gunicorn master.
+- 'fastest' times both once per process and keeps the faster one. Which
+  wins depends on the machine: NumPy >= 1.22 on AVX-512 CPUs has SIMD
+  expm1/log1p that beat Numba's scalar libm calls, while elsewhere the
+  single fused loop wins.
+- 'auto' is the MODEL_KERNEL environment variable ('numpy', 'numba' or
+  'fastest'), 'numpy' if unset.
+
+The kernels differ in the last bits, so the same seed reproduces the same
+results only under the same kernel. 'auto' is therefore deterministic by
+default; 'fastest' may pick differently in different processes and is
+opt-in.
+
+The numba loop takes scalar scenario parameters; sweeps with array
+parameters use the numpy kernel.
+
+Accuracy: both kernels agree with an extended-precision (long double)
+evaluation of the model to RTOL relative error (see check_kernel). The
+reference pipeline is only good to about 1e-8 relative, and worse still
+for semester probabilities below about 1e-8, where 1-p rounds.
+"""
+
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+KERNELS = ('auto','fastest','numba','numpy','reference')
+RTOL = 1e-13
+#Uncertain inputs used by the kernels, in argument order (as model.INPUTS)
+INPUT_NAMES = ('VENT','DECAY','DEP','OTHER','EFFOUT','EMMFx','EMMSx',
+               'INFRATEF','INFRATES','EFFIN','BRFx','BRSx')
+
+#%% NumPy
+def numpy_kernel(inputs,surface_area,height,num_faculty,num_students,duration,num_class_periods):
+    """(PFsemester, PSsemester) from a dict of sampled inputs, with NumPy."""
+    VENT,DECAY,DEP,OTHER,EFFOUT,EMMFx,EMMSx,INFRATEF,INFRATES,EFFIN,BRFx,BRSx = [inputs[n] for n in INPUT_NAMES]
+    hours = duration/60
+    VOL = surface_area * height*0.305**3
+    #Dose scale per unit emission and breathing rate:
+    #(1-EFFOUT)/(L*VOL)*(1-(1-exp(-LDUR))/LDUR) * (1-EFFIN)*hours*60
+    L = np.add(VENT,DECAY); L += DEP; L += OTHER
+    LDUR = np.multiply(L,hours)
+    S = np.negative(LDUR); np.expm1(S,out=S); S /= LDUR; S += 1
+    np.subtract(1,EFFOUT,out=LDUR); LDUR /= L; S *= LDUR
+    np.subtract(1,EFFIN,out=L); L *= hours*60/VOL; S *= L
+    #log(1-p) of each infection probability, p = rate*(1-exp(-dose))
+    def log_escape(emission,breathing,rate,out):
+        np.power(10,emission,out=out); out *= S; out *= breathing
+        np.negative(out,out=out); np.expm1(out,out=out); out *= rate
+        return np.log1p(out,out=out)
+    PFsemester = log_escape(EMMSx,BRFx,INFRATES,L)
+    PFsemester *= num_students*num_class_periods
+    np.expm1(PFsemester,out=PFsemester); np.negative(PFsemester,out=PFsemester)
+    PSsemester = log_escape(EMMSx,BRSx,INFRATES,LDUR)
+    PSsemester *= num_students-1
+    T = log_escape(EMMFx,BRSx,INFRATEF,np.empty_like(S))
+    T *= num_faculty; PSsemester += T
+    PSsemester *= num_class_periods
+    np.expm1(PSsemester,out=PSsemester); np.negative(PSsemester,out=PSsemester)
+    return PFsemester,PSsemester
+
+#%% Numba
+_numba_loop = None
+#Guards the one-off compilation and calibration against concurrent requests
+_init_lock = threading.RLock()
+
+def _compile():
+    import numba
+    @numba.njit(nogil=True)
+    def loop(VENT,DECAY,DEP,OTHER,EFFOUT,EMMFx,EMMSx,INFRATEF,INFRATES,EFFIN,BRFx,BRSx,
+             VOL,hours,num_faculty,num_students,num_class_periods,PFsemester,PSsemester):
+        for i in range(VENT.size):
+            L = VENT[i] + DECAY[i] + DEP[i] + OTHER[i]
+            LDUR = L*hours
+            S = (math.expm1(-LDUR)/LDUR + 1)*(1-EFFOUT[i])/L*(1-EFFIN[i])*(hours*60/VOL)
+            EMMF = 10.0**EMMFx[i]
+            EMMS = 10.0**EMMSx[i]
+            BRF = BRFx[i]
+            BRS = BRSx[i]
+            lPF_S = math.log1p(math.expm1(-EMMS*S*BRF)*INFRATES[i])
+            lPS_S = math.log1p(math.expm1(-EMMS*S*BRS)*INFRATES[i])
+            lPS_F = math.log1p(math.expm1(-EMMF*S*BRS)*INFRATEF[i])
+            PFsemester[i] = -math.expm1(num_class_periods*num_students*lPF_S)
+            PSsemester[i] = -math.expm1(num_class_periods*((num_students-1)*lPS_S + num_faculty*lPS_F))
+    return loop
+
+def numba_available():
+    try:
+        import numba
+    except ImportError:
+        return False
+    return True
+
+def numba_kernel(inputs,surface_area,height,num_faculty,num_students,duration,num_class_periods):
+    """(PFsemester, PSsemester) with the Numba loop; parameters must be scalars."""
+    global _numba_loop
+    if _numba_loop is None:
+        with _init_lock:
+            if _numba_loop is None: _numba_loop = _compile()
+    arrays = [inputs[n] for n in INPUT_NAMES]
+    shape = arrays[0].shape
+    arrays = [np.ascontiguousarray(a).ravel() for a in arrays]
+    PFsemester = np.empty(arrays[0].size,dtype=arrays[0].dtype)
+    PSsemester = np.empty_like(PFsemester)
+    _numba_loop(*arrays,float(surface_area*height*0.305**3),float(duration/60),
+                float(num_faculty),float(num_students),float(num_class_periods),
+                PFsemester,PSsemester)
+    return PFsemester.reshape(shape),PSsemester.reshape(shape)
+
+#%% Selection
+def _from_environ(environ=os.environ):
+    name = environ.get('MODEL_KERNEL') or 'numpy'
+    if name not in ('fastest','numba','numpy'):
+        raise ValueError(f"MODEL_KERNEL must be 'numpy', 'numba' or 'fastest', not {name!r}")
+    return name
+
+#What 'auto' means in this process, and what 'fastest' found once timed
+DEFAULT = _from_environ()
+_fastest = None
+
+def _sample_inputs(n=20000,seed=0,**params):
+    from model import INPUTS, get_normal, get_random
+    from sweep import DEFAULTS
+    params = dict(DEFAULTS,**params)
+    rs = np.random.RandomState(seed)
+    inputs = {name:get_random(params[param],n,rs) if kind == 'uniform' else get_normal(params[param],n,rs)
+              for name,kind,param in INPUTS}
+    scenario = {k:params[k] for k in ('surface_area','height','num_faculty','num_students',
+                                      'duration','num_class_periods')}
+    return inputs,scenario
+
+def _calibrate():
+    #Fastest available kernel on this machine, best of a few small runs
+    if not numba_available(): return 'numpy'
+    inputs,scenario = _sample_inputs()
+    timings = {}
+    for name,func in (('numpy',numpy_kernel),('numba',numba_kernel)):
+        func(inputs,**scenario)
+        best = np.inf
+        for _ in range(5):
+            started = time.perf_counter()
+            func(inputs,**scenario)
+            best = min(best,time.perf_counter() - started)
+        timings[name] = best
+    return min(timings,key=timings.get)
+
+def fused(inputs,kernel='auto',**params):
+    """Run the named kernel on sampled inputs; params are the six scenario scalars.
+
+    'auto' and 'fastest' use the numpy kernel for array parameters.
+    """
+    global _fastest
+    if kernel not in KERNELS or kernel == 'reference':
+        raise ValueError(f'kernel must be one of {KERNELS[:-1]}, not {kernel!r}')
+    scalar = all(np.ndim(v) == 0 for v in params.values())
+    if kernel in ('auto','fastest'):
+        kernel = DEFAULT if kernel == 'auto' else kernel
+        if kernel == 'fastest':
+            if _fastest is None:
+                with _init_lock:
+                    if _fastest is None: _fastest = _calibrate()
+            kernel = _fastest
+        if not scalar: kernel = 'numpy'
+    if kernel == 'numba':
+        if not scalar: raise ValueError('the numba kernel needs scalar scenario parameters')
+        return numba_kernel(inputs,**params)
+    return numpy_kernel(inputs,**params)
+
+def warm_up(kernel='auto'):
+    """Compile (and for 'fastest', time) the kernel now rather than on first use."""
+    inputs,scenario = _sample_inputs(1000)
+    fused(inputs,kernel,**scenario)
+
+def extended_kernel(inputs,surface_area,height,num_faculty,num_students,duration,num_class_periods):
+    """The model in np.longdouble, as the yardstick for the other kernels.
+
+    On platforms where long double is plain double this checks little.
+    """
+    VENT,DECAY,DEP,OTHER,EFFOUT,EMMFx,EMMSx,INFRATEF,INFRATES,EFFIN,BRFx,BRSx = [
+        np.asarray(inputs[n],dtype=np.longdouble) for n in INPUT_NAMES]
+    hours = np.longdouble(duration)/60
+    VOL = np.longdouble(surface_area)*height*np.longdouble(0.305)**3
+    L = VENT + DECAY + DEP + OTHER
+    S = (1-EFFOUT)/L/VOL*(1 - (1-np.exp(-L*hours))/(L*hours)) * (1-EFFIN)*hours*60
+    lPF_S = np.log1p(-(1-np.exp(-10**EMMSx*S*BRFx))*INFRATES)
+    lPS_S = np.log1p(-(1-np.exp(-10**EMMSx*S*BRSx))*INFRATES)
+    lPS_F = np.log1p(-(1-np.exp(-10**EMMFx*S*BRSx))*INFRATEF)
+    return (-np.expm1(num_class_periods*num_students*lPF_S),
+            -np.expm1(num_class_periods*((num_students-1)*lPS_S + num_faculty*lPS_F)))
+
+def check_kernel(kernel='auto',num_runs=100000,seed=0,**params):
+    """Largest relative error of a kernel against extended_kernel, in units
+    of RTOL (<= 1 passes). kernel='reference' measures run_model's pipeline."""
+    from model import run_model
+    inputs,scenario = _sample_inputs(num_runs,seed,**params)
+    exact = extended_kernel(inputs,**scenario)
+    if kernel == 'reference':
+        result = run_model(num_runs=num_runs,random_state=np.random.RandomState(seed),kernel='reference',**params)
+        new = (result['PFsemester'],result['PSsemester'])
+    else:
+        new = fused(inputs,kernel,**scenario)
+    return max(float(np.max(np.abs((n-e)/e))) for n,e in zip(new,exact)) / RTOL
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Hot-path instrumentation and a Prometheus-text /metrics route.
+
+Code is timed in named stages, either as a block or a decorated function:
+
+    with stage('summarize'): ...
+
+    @timed('figure')
+    def update_figure(...): ...
+
+or, for consecutive sections of one long function, with Laps. Each stage
+feeds the model_stage_seconds histogram. Stages nest; each is timed on its
+own. With METRICS_ALLOCATIONS=1, tracemalloc also runs and the peak bytes
+allocated within each stage are counted. This is slow and only approximate
+when requests overlap in threads.
+
+register(server) adds the /metrics route and request hooks that record
+latency, counts by status, and the queue time before a worker picked the
+request up (from an X-Request-Start header set by the proxy). It also
+records the time Dash spends serializing a callback's return value. Each
+gunicorn worker reports its own numbers under a `worker` (pid) label, so a
+local scrape (`curl localhost:8000/metrics`) shows one worker. Set
+METRICS_PROFILE_DIR to dump a cProfile file (.prof, read with pstats or
+snakeviz) for every request.
+"""
+
+import cProfile
+import functools
+import itertools
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+LATENCY_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30)
+
+#%% Metric types
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+class Counter(object):
+    def __init__(self,name,help):
+        self.name = name
+        self.help = help
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self,amount=1,**labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key,0) + amount
+
+    def value(self,**labels):
+        return self._values.get(_key(labels),0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name,key,value) for key,value in self._values.items()]
+
+class Histogram(object):
+    """Cumulative-bucket histogram, with a sum and a count, per label set."""
+    def __init__(self,name,help,buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = 'histogram'
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self,value,**labels):
+        key = _key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0]*len(self.buckets),0.0,0]
+            for i,bound in enumerate(self.buckets):
+                if value <= bound: entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def sum(self,**labels):
+        entry = self._values.get(_key(labels))
+        return 0.0 if entry is None else entry[1]
+
+    def count(self,**labels):
+        entry = self._values.get(_key(labels))
+        return 0 if entry is None else entry[2]
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key,(counts,total,n) in self._values.items():
+                for bound,c in zip(self.buckets,counts):
+                    out.append((self.name + '_bucket',key + (('le',f'{bound:g}'),),c))
+                out.append((self.name + '_bucket',key + (('le','+Inf'),),n))
+                out.append((self.name + '_sum',key,total))
+                out.append((self.name + '_count',key,n))
+        return out
+
+class Gauge(object):
+    #Computed at scrape time: func() returns a number or {labels tuple: number}.
+    #type='counter' exposes a count kept elsewhere (e.g. cache hits)
+    def __init__(self,name,help,func,type='gauge'):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if not isinstance(value,dict): value = {(): value}
+        return [(self.name,key,v) for key,v in value.items()]
+
+def _format_labels(labels):
+    if not labels: return ''
+    escape = lambda v: str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k,v in labels) + '}'
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self,metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self,name,help):
+        return self.add(Counter(name,help))
+
+    def histogram(self,name,help,buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name,help,buckets))
+
+    def gauge(self,name,help,func,type='gauge'):
+        return self.add(Gauge(name,help,func,type))
+
+    def render(self):
+        """Every metric in the Prometheus text format (version 0.0.4)."""
+        worker = (('worker',os.getpid()),)
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name,labels,value in metric.samples():
+                lines.append(f'{name}{_format_labels(worker + tuple(labels))} {float(value):.10g}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('model_stage_seconds','Time spent in each instrumented stage')
+STAGE_BYTES = REGISTRY.counter('model_stage_allocated_bytes_total',
+                               'Peak bytes allocated within each stage (METRICS_ALLOCATIONS=1)')
+SAMPLES = REGISTRY.counter('model_samples_total','Monte Carlo samples evaluated')
+#Kept apart from SAMPLES: an incremental update recomputes only some stages
+#and is timed as stage model.incremental, not model
+INCREMENTAL_SAMPLES = REGISTRY.counter('model_incremental_samples_total',
+                                       'Monte Carlo samples updated by incremental models')
+REQUESTS = REGISTRY.counter('http_requests_total','HTTP requests by path, method and status')
+REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds','Time to handle each request')
+QUEUE_SECONDS = REGISTRY.histogram('http_request_queue_seconds',
+                                   'Time from the proxy (X-Request-Start) to the worker starting the request')
+REGISTRY.gauge('model_samples_per_second','Samples evaluated per second of model compute',
+               lambda: SAMPLES.value() / STAGE_SECONDS.sum(stage='model') if STAGE_SECONDS.count(stage='model') else 0)
+
+#%% Stages
+_local = threading.local()
+ALLOCATIONS = os.environ.get('METRICS_ALLOCATIONS','0') == '1'
+if ALLOCATIONS: tracemalloc.start()
+
+class stage(object):
+    """Context manager timing a named stage (and its allocations, if enabled)."""
+    __slots__ = ('name','started','start_bytes','peak')
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        if ALLOCATIONS:
+            stack = _local.__dict__.setdefault('stack',[])
+            self.start_bytes = self.peak = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started,stage=self.name)
+        if ALLOCATIONS:
+            #An inner stage resets the tracemalloc peak, so it hands its own
+            #peak up to the enclosing stage when it finishes
+            stack = _local.stack
+            peak = max(self.peak,tracemalloc.get_traced_memory()[1])
+            STAGE_BYTES.inc(peak - self.start_bytes,stage=self.name)
+            if self in stack: del stack[stack.index(self):]
+            if stack: stack[-1].peak = max(stack[-1].peak,peak)
+        return False
+
+def timed(name,callback=False):
+    """Decorator running the whole function as one stage.
+
+    With callback=True (for Dash callbacks) the time from its return to the
+    end of the request is recorded as the 'serialize' stage.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            with stage(name):
+                value = func(*args,**kwargs)
+            if callback: _local.callback_done = time.perf_counter()
+            return value
+        return wrapper
+    return decorate
+
+class Laps(object):
+    """Consecutive stages of one function without re-indenting it.
+
+    lap = Laps('model'); ...; lap('sample'); ...; lap('powers'); ...; lap.done()
+    times each section from its lap() call to the next one (or done()).
+    """
+    def __init__(self,prefix):
+        self.prefix = prefix
+        self._current = None
+
+    def __call__(self,name):
+        self.done()
+        self._current = stage(f'{self.prefix}.{name}').__enter__()
+
+    def done(self):
+        if self._current is not None:
+            self._current.__exit__(None,None,None)
+            self._current = None
+
+#%% Flask integration
+_profiles = itertools.count()
+
+def _queue_time(header,now):
+    #X-Request-Start: "t=<seconds>" (or ms/us since the epoch, as nginx and others send)
+    try:
+        value = float(header.strip().lstrip('t='))
+    except ValueError:
+        return None
+    while value > 1e11: value /= 1000
+    return max(now - value,0.0)
+
+def register(server,path='/metrics',profile_dir=None):
+    """Add the /metrics route and per-request instrumentation to a Flask app."""
+    from flask import Response, g, request
+    profile_dir = profile_dir or os.environ.get('METRICS_PROFILE_DIR')
+    if profile_dir: os.makedirs(profile_dir,exist_ok=True)
+
+    def before():
+        g.metrics_started = time.perf_counter()
+        _local.callback_done = None
+        header = request.headers.get('X-Request-Start')
+        if header:
+            queued = _queue_time(header,time.time())
+            if queued is not None: QUEUE_SECONDS.observe(queued)
+        if profile_dir:
+            g.metrics_profile = cProfile.Profile()
+            try:
+                g.metrics_profile.enable()
+            except ValueError:
+                #Another thread's profiler is active (Python 3.12+ allows only one)
+                g.metrics_profile = None
+
+    def after(response):
+        now = time.perf_counter()
+        started = g.pop('metrics_started',None)
+        if started is None: return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(now - started,path=route)
+        REQUESTS.inc(path=route,method=request.method,status=response.status_code)
+        callback_done = getattr(_local,'callback_done',None)
+        if callback_done is not None:
+            STAGE_SECONDS.observe(now - callback_done,stage='serialize')
+        profile = g.pop('metrics_profile',None)
+        if profile is not None:
+            profile.disable()
+            slug = re.sub(r'[^A-Za-z0-9]+','-',request.path).strip('-') or 'root'
+            name = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{next(_profiles)}-{slug}.prof'
+            profile.dump_stats(os.path.join(profile_dir,name))
+        return response
+
+    def metrics_view():
+        return Response(REGISTRY.render(),mimetype='text/plain; version=0.0.4')
+
+    server.before_request(before)
+    server.after_request(after)
+    server.add_url_rule(path,'metrics',metrics_view,methods=['GET'])
+    return server
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo model of airborne COVID-19 exposure during classroom teaching.
+
+The model is evaluated on plain NumPy arrays (a "struct of arrays") using
+in-place ufuncs over a handful of reusable buffers. By default only the
+semester outputs are kept; pass keep_intermediates=True (or call update_df)
+to get every intermediate column, e.g. for a pandas DataFrame view.
+"""
+
+import numpy as np
+
+from kernels import fused
+from metrics import SAMPLES, Laps, timed
+from sampling import as_generator, draw_inputs
+
+#Columns of the full (DataFrame) view, in their historical order
+COLUMNS = ('VENT','DECAY','DEP','OTHER','L','LDUR','VOL','EFFOUT',
+           'EMMFx','EMMSx','EMMF','EMMS','INFRATEF','INFRATES',
+           'CONCF','CONCS','EFFIN','BRFx','BRSx','BRF','BRS',
+           'INF_S','INS_F','INS_S','PF_S','PS_F','PS_S','PF','PS',
+           'nPF','nPFsemester','PFsemester','nPS','nPSsemester','PSsemester')
+OUTPUTS = ('PFsemester','PSsemester')
+#Uncertain inputs in draw order: column, distribution, update_df argument
+INPUTS = (('VENT','uniform','ventilation_w_outside_air'),
+          ('DECAY','uniform','decay_rate_of_virus'),
+          ('DEP','uniform','deposition_to_surface'),
+          ('OTHER','uniform','additional_control_measures'),
+          ('EFFOUT','uniform','exhalation_mask_efficiency'),
+          ('EMMFx','normal','quanta_emission_rate_faculty'),
+          ('EMMSx','normal','quanta_emission_rate_student'),
+          ('INFRATEF','uniform','background_infection_rate_faculty'),
+          ('INFRATES','uniform','background_infection_rate_student'),
+          ('EFFIN','uniform','inhalation_mask_efficiency'),
+          ('BRFx','uniform','breathing_rate_faculty'),
+          ('BRSx','uniform','breathing_rate_student'))
+#Quantiles reported alongside the mean in every summary
+QUANTILES = (0.05,0.25,0.5,0.75,0.95)
+
+#%% Random inputs
+def get_random(var,n=10000,random_state=None):
+    #low + (high-low)*u, as RandomState.uniform draws it. Generator.uniform
+    #rejects high < low; this accepts it on every path, as the original
+    #np.random.uniform and the samplers and incremental stages do
+    rs = as_generator(random_state)
+    return var[0] + (var[1]-var[0])*rs.random(n)
+
+def get_normal(var,n=10000,random_state=None):
+    rs = as_generator(random_state)
+    return rs.normal(*var+[n])
+
+#%% Storage
+class Workspace(object):
+    """Hands out the arrays used by one model evaluation.
+
+    In the default mode arrays that are no longer needed are overwritten in
+    place, so a run touches only a few buffers. With keep=True every named
+    intermediate gets its own array and is recorded in ``columns``.
+    """
+    def __init__(self):
+        self.shape = (0,)
+        self.dtype = np.dtype(np.float64)
+        self.keep = False
+        self.columns = {}
+
+    def reset(self,shape,dtype=np.float64,keep=False):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.keep = keep
+        self.columns = {}
+
+    def draw(self,name,values):
+        #Sampled inputs arrive freshly allocated; cast once and adopt them
+        values = np.asarray(values).astype(self.dtype,copy=False)
+        if self.keep: self.columns[name] = values
+        return values
+
+    def buffer(self,name,reuse):
+        #Overwrite `reuse` unless intermediates are being kept
+        if not self.keep: return reuse
+        arr = np.empty(self.shape,dtype=self.dtype)
+        if name is not None: self.columns[name] = arr
+        return arr
+
+class ModelResult(object):
+    """Struct of arrays holding the outputs of one Monte Carlo run.
+
+    Columns are accessed like a DataFrame (``result['PFsemester']``);
+    ``to_frame`` builds the pandas view for callers that want one. For a
+    sweep the arrays are 2-D with one row per scenario.
+    """
+    def __init__(self,columns,shape):
+        self.columns = columns
+        self.shape = shape
+        self.num_runs = shape[-1]
+
+    def __getitem__(self,name):
+        return self.columns[name]
+
+    def __contains__(self,name):
+        return name in self.columns
+
+    def __len__(self):
+        return self.num_runs
+
+    def keys(self):
+        return [c for c in COLUMNS if c in self.columns]
+
+    def to_frame(self):
+        import pandas as pd
+        if len(self.shape) != 1:
+            raise ValueError('to_frame needs a single-scenario result')
+        return pd.DataFrame({c:self.columns[c] for c in self.keys()},
+                            index=np.arange(self.num_runs))
+
+#%% Model
+@timed('model')
+def run_model(surface_area = 900,
+              height = 10,
+              num_faculty = 1,
+              num_students = 10,
+              duration = 75,
+              num_class_periods = 26,
+              breathing_rate_faculty = [0.027,0.029],
+              breathing_rate_student = [0.012,0.012],
+              ventilation_w_outside_air = [1,4],
+              decay_rate_of_virus = [0,1.0],
+              deposition_to_surface = [0.3,1.5],
+              additional_control_measures = [0,0],
+              quanta_emission_rate_faculty = [1.5,0.71],
+              quanta_emission_rate_student = [0.69,0.71],
+              exhalation_mask_efficiency = [0.4,0.6],
+              inhalation_mask_efficiency = [0.3,0.5],
+              background_infection_rate_faculty = [0.0070,0.0140],
+              background_infection_rate_student = [0.0070,0.0140],
+              num_runs = 10000,
+              dtype = np.float64,
+              keep_intermediates = False,
+              random_state = None,
+              sampling = 'random',
+              kernel = 'auto'):
+    """Run the Monte Carlo model on arrays and return a ModelResult.
+
+    dtype=np.float32 halves memory traffic; means stay accurate to ~1e-6
+    but the smallest semester probabilities lose a few digits.
+
+    num_runs may also be a (scenarios, samples) shape, in which case every
+    parameter may be a column array of length `scenarios` (see sweep.py).
+    random_state is a np.random.Generator or RandomState, or a seed for a
+    new Generator (see sampling.as_generator). By default each call seeds
+    its own Generator from fresh entropy; the global np.random state is
+    never used, so concurrent calls are independent and thread-safe.
+    sampling picks how the inputs are drawn: 'random' (get_random and
+    get_normal), 'sobol', 'lhs' or 'antithetic' (see sampling.py), or an
+    explicit (samples, len(INPUTS)) array of unit-hypercube points.
+    kernel picks how the outputs are computed from the draws: 'auto'
+    (MODEL_KERNEL, 'numpy' by default), 'fastest', 'numba' or 'numpy' run
+    a fused kernel (see kernels.py), 'reference' the ufunc pipeline below,
+    which keep_intermediates always uses.
+    """
+    args = locals()
+    random_state = as_generator(random_state)
+    shape = tuple(num_runs) if np.ndim(num_runs) else (num_runs,)
+    ws = Workspace()
+    ws.reset(shape,dtype,keep_intermediates)
+    lap = Laps('model')
+    lap('sample')
+    #Draw the uncertain inputs (same order as the original column pipeline)
+    specs = [(name,kind,args[param]) for name,kind,param in INPUTS]
+    if isinstance(sampling,str) and sampling == 'random':
+        draws = [get_random(var,shape,random_state) if kind == 'uniform'
+                 else get_normal(var,shape,random_state) for _,kind,var in specs]
+    else:
+        draws = draw_inputs([(kind,var) for _,kind,var in specs],shape,sampling,random_state)
+    (VENT,DECAY,DEP,OTHER,EFFOUT,EMMFx,EMMSx,
+     INFRATEF,INFRATES,EFFIN,BRFx,BRSx) = [ws.draw(name,values) for (name,_,_),values in zip(specs,draws)]
+    if kernel != 'reference' and not ws.keep:
+        lap('kernel')
+        inputs = dict(VENT=VENT,DECAY=DECAY,DEP=DEP,OTHER=OTHER,EFFOUT=EFFOUT,EMMFx=EMMFx,EMMSx=EMMSx,
+                      INFRATEF=INFRATEF,INFRATES=INFRATES,EFFIN=EFFIN,BRFx=BRFx,BRSx=BRSx)
+        PFsemester,PSsemester = fused(inputs,kernel,surface_area=surface_area,height=height,
+                                      num_faculty=num_faculty,num_students=num_students,
+                                      duration=duration,num_class_periods=num_class_periods)
+        lap.done()
+        SAMPLES.inc(int(np.prod(shape)))
+        return ModelResult({'PFsemester':PFsemester,'PSsemester':PSsemester},shape)
+    lap('concentration')
+    VOL = surface_area * height*0.305**3
+    if ws.keep: ws.columns['VOL'] = np.broadcast_to(VOL,shape).astype(ws.dtype)
+    #Total loss rate and loss over the class session
+    L = ws.buffer('L',VENT)
+    np.add(VENT,DECAY,out=L); L += DEP; L += OTHER
+    LDUR = ws.buffer('LDUR',DECAY)
+    np.multiply(L,duration/60,out=LDUR)
+    #Shared concentration factor: (1-EFFOUT)/(L*VOL)*(1-1/LDUR*(1-exp(-LDUR)))
+    G = ws.buffer(None,DEP)
+    np.negative(LDUR,out=G); np.expm1(G,out=G); G /= LDUR; G += 1
+    C = ws.buffer(None,OTHER)
+    np.subtract(1,EFFOUT,out=C); C /= L; C /= VOL; C *= G
+    #Emission rates and average concentrations
+    EMMF = ws.buffer('EMMF',EMMFx)
+    np.power(10,EMMFx,out=EMMF)
+    EMMS = ws.buffer('EMMS',EMMSx)
+    np.power(10,EMMSx,out=EMMS)
+    CONCF = ws.buffer('CONCF',EMMF)
+    np.multiply(EMMF,C,out=CONCF)
+    CONCS = ws.buffer('CONCS',EMMS)
+    np.multiply(EMMS,C,out=CONCS)
+    #Inhaled doses
+    D = ws.buffer(None,EFFIN)
+    np.subtract(1,EFFIN,out=D); D *= duration/60
+    BRF = ws.buffer('BRF',BRFx)
+    np.multiply(BRFx,60,out=BRF)
+    BRS = ws.buffer('BRS',BRSx)
+    np.multiply(BRSx,60,out=BRS)
+    INF_S = ws.buffer('INF_S',BRF)
+    np.multiply(CONCS,BRF,out=INF_S); INF_S *= D
+    INS_F = ws.buffer('INS_F',CONCF)
+    np.multiply(CONCF,BRS,out=INS_F); INS_F *= D
+    INS_S = ws.buffer('INS_S',BRS)
+    np.multiply(CONCS,BRS,out=INS_S); INS_S *= D
+    # INECTION PROBABILITIES FOR FACULTY/STUDENT INFECTION: rate*(1-exp(-dose))
+    lap('infection')
+    PF_S = ws.buffer('PF_S',INF_S)
+    np.negative(INF_S,out=PF_S); np.expm1(PF_S,out=PF_S); np.negative(PF_S,out=PF_S); PF_S *= INFRATES
+    PS_F = ws.buffer('PS_F',INS_F)
+    np.negative(INS_F,out=PS_F); np.expm1(PS_F,out=PS_F); np.negative(PS_F,out=PS_F); PS_F *= INFRATEF
+    PS_S = ws.buffer('PS_S',INS_S)
+    np.negative(INS_S,out=PS_S); np.expm1(PS_S,out=PS_S); np.negative(PS_S,out=PS_S); PS_S *= INFRATES
+    # PROBABILITIES OF ESCAPING INFECTION IN 1 CLASS SESSION
+    lap('powers')
+    nPF = ws.buffer('nPF',PF_S)
+    np.subtract(1,PF_S,out=nPF); nPF **= num_students
+    nPS = ws.buffer('nPS',PS_S)
+    np.subtract(1,PS_S,out=nPS); nPS **= (num_students-1)
+    T = ws.buffer(None,PS_F)
+    np.subtract(1,PS_F,out=T); T **= num_faculty; nPS *= T
+    if ws.keep:
+        ws.columns['PF'] = 1 - nPF
+        ws.columns['PS'] = 1 - nPS
+    # INFECTION PROBABILITIES FOR SEMESTER
+    nPFsemester = ws.buffer('nPFsemester',nPF)
+    np.power(nPF,num_class_periods,out=nPFsemester)
+    nPSsemester = ws.buffer('nPSsemester',nPS)
+    np.power(nPS,num_class_periods,out=nPSsemester)
+    columns = ws.columns
+    columns['PFsemester'] = 1 - nPFsemester
+    columns['PSsemester'] = 1 - nPSsemester
+    lap.done()
+    SAMPLES.inc(int(np.prod(shape)))
+    return ModelResult(columns,shape)
+
+@timed('update_df')
+def update_df(surface_area = 900,
+              height = 10,
+              num_faculty = 1,
+              num_students = 10,
+              duration = 75,
+              num_class_periods = 26,
+              breathing_rate_faculty = [0.027,0.029],
+              breathing_rate_student = [0.012,0.012],
+              ventilation_w_outside_air = [1,4],
+              decay_rate_of_virus = [0,1.0],
+              deposition_to_surface = [0.3,1.5],
+              additional_control_measures = [0,0],
+              quanta_emission_rate_faculty = [1.5,0.71],
+              quanta_emission_rate_student = [0.69,0.71],
+              exhalation_mask_efficiency = [0.4,0.6],
+              inhalation_mask_efficiency = [0.3,0.5],
+              background_infection_rate_faculty = [0.0070,0.0140],
+              background_infection_rate_student = [0.0070,0.0140],
+              random_state = None):
+    #Full DataFrame of 10,000 runs with every intermediate column
+    return run_model(**locals(),keep_intermediates=True).to_frame()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel Monte Carlo execution over a local process pool (or dask).
+
+The sample budget is split into fixed-size chunks, and chunk i always draws
+from the i-th stream spawned from SeedSequence(seed). Chunk results are
+merged in chunk order, so a given seed gives bit-identical output however
+many workers are used. Only a bounded number of chunks is in flight at a
+time, and results are handed back as they complete, so streamed runs fold
+them into one accumulator without holding every chunk.
+"""
+
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model import OUTPUTS, ModelResult, run_model
+from streaming import StreamResult
+
+def spawn_streams(seed,num_chunks):
+    """One independent Generator per chunk, derived from a single seed."""
+    children = np.random.SeedSequence(seed).spawn(num_chunks)
+    return [np.random.default_rng(child) for child in children]
+
+def imap_chunks(func,tasks,workers=None,backend='processes',max_pending=None):
+    """Yield func(task) for each task, in order, locally or over a worker pool.
+
+    backend is 'processes' (concurrent.futures) or 'dask' (dask's local
+    multiprocessing scheduler). workers=1 runs in the calling process.
+    tasks may be any iterable; at most max_pending of them (default twice
+    the number of workers) are submitted ahead of the result being yielded.
+    """
+    if backend not in ('processes','dask'):
+        raise ValueError(f'unknown backend: {backend}')
+    if workers == 1:
+        for task in tasks: yield func(task)
+        return
+    max_pending = max_pending or 2*(workers or os.cpu_count() or 1)
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if backend == 'dask':
+            import dask
+            while True:
+                wave = list(itertools.islice(tasks,max_pending))
+                if not wave: return
+                yield from dask.compute(*[dask.delayed(func)(task) for task in wave],
+                                        scheduler='processes',pool=pool)
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(func,task))
+            if len(pending) >= max_pending: yield pending.popleft().result()
+        while pending: yield pending.popleft().result()
+
+def map_chunks(func,tasks,workers=None,backend='processes'):
+    """imap_chunks as a list."""
+    return list(imap_chunks(func,tasks,workers,backend))
+
+def _run_chunk(task):
+    n,rng,dtype,stream,params = task
+    result = run_model(num_runs=n,dtype=dtype,random_state=rng,**params)
+    if stream: return StreamResult().update(result)
+    return {fld:result[fld] for fld in OUTPUTS}
+
+def parallel_model(num_runs=10**6,seed=None,chunk_size=100000,workers=None,
+                   backend='processes',stream=False,dtype=np.float64,**params):
+    """Evaluate the model over num_runs samples split across workers.
+
+    params are update_df keyword arguments. Returns a ModelResult of the
+    semester outputs, or a StreamResult of accumulators if stream=True.
+    Streamed chunks are merged into one StreamResult as they complete, so
+    memory then stays bounded by the chunks in flight (see imap_chunks),
+    whatever num_runs is.
+    """
+    sizes = range(0,num_runs,chunk_size)
+    children = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = ((min(chunk_size,num_runs-start),np.random.default_rng(child),dtype,stream,params)
+             for start,child in zip(sizes,children))
+    parts = imap_chunks(_run_chunk,tasks,workers,backend)
+    if stream:
+        result = StreamResult()
+        for part in parts: result.merge(part)
+        return result
+    parts = list(parts)
+    columns = {fld:np.concatenate([part[fld] for part in parts]) for fld in OUTPUTS}
+    return ModelResult(columns,(num_runs,))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling strategies for the uncertain model inputs.
+
+Besides plain pseudo-random draws ('random', the get_random/get_normal
+path) the model can be driven by points from the unit hypercube:
+
+  'sobol'       scrambled Sobol sequence (random linear scramble plus
+                digital shift); best with a power-of-two sample count
+  'lhs'         Latin Hypercube: one draw per equal-probability stratum
+  'antithetic'  pseudo-random points paired with their mirror 1-u
+
+Unit points are mapped through the same ranges as get_random (uniform
+inputs) and through the inverse normal CDF for the log10 quanta emission
+rates, so every strategy feeds the same log-normal transform.
+"""
+
+import numbers
+
+import numpy as np
+
+STRATEGIES = ('random','sobol','lhs','antithetic')
+
+def as_generator(random_state=None):
+    """A random source for random_state arguments.
+
+    Generators and RandomStates pass through. An int or SeedSequence seeds
+    a new Generator, and None seeds one from fresh OS entropy. Nothing falls
+    back to the global np.random state, so concurrent requests never share
+    (or race on) a generator.
+    """
+    if random_state is None or isinstance(random_state,(numbers.Integral,np.random.SeedSequence)):
+        return np.random.default_rng(random_state)
+    return random_state
+
+#%% Inverse normal CDF (Acklam's rational approximation, |rel. err| < 1.2e-9)
+_A = (-3.969683028665376e+01, 2.209460984245205e+02,-2.759285104469687e+02,
+       1.383577518672690e+02,-3.066479806614716e+01, 2.506628277459239e+00)
+_B = (-5.447609879822406e+01, 1.615858368580409e+02,-1.556989798598866e+02,
+       6.680131188771972e+01,-1.328068155288572e+01)
+_C = (-7.784894002430293e-03,-3.223964580411365e-01,-2.400758277161838e+00,
+      -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_D = ( 7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+       3.754408661907416e+00)
+_P_LOW = 0.02425
+
+def _tail(p):
+    q = np.sqrt(-2*np.log(p))
+    return np.polyval(_C,q) / np.polyval(_D+(1,),q)
+
+def norm_ppf(u):
+    """Standard normal quantile function for u in (0, 1)."""
+    u = np.asarray(u,dtype=np.float64)
+    x = np.empty_like(u)
+    low = u < _P_LOW
+    high = u > 1 - _P_LOW
+    mid = ~(low | high)
+    q = u[mid] - 0.5
+    r = q*q
+    x[mid] = np.polyval(_A,r) * q / np.polyval(_B+(1,),r)
+    x[low] = _tail(u[low])
+    x[high] = -_tail(1 - u[high])
+    return x
+
+#%% Unit hypercube samplers
+#Joe & Kuo (2008) direction numbers for dimensions 2-16: (s, a, m_1..m_s)
+_SOBOL_PARAMS = ((1,0,(1,)),(2,1,(1,3)),(3,1,(1,3,1)),(3,2,(1,1,1)),
+                 (4,1,(1,1,3,3)),(4,4,(1,3,5,13)),(5,2,(1,1,5,5,17)),
+                 (5,4,(1,1,5,5,5)),(5,7,(1,1,7,11,19)),(5,11,(1,1,5,1,1)),
+                 (5,13,(1,1,1,3,11)),(5,14,(1,3,5,5,31)),
+                 (6,1,(1,3,3,9,7,49)),(6,13,(1,1,1,15,21,21)),
+                 (6,16,(1,3,1,13,27,49)))
+_SOBOL_BITS = 30
+
+def _direction_numbers(dim):
+    #v[k] for k = 0..BITS-1, as integers scaled by 2**BITS
+    bits = _SOBOL_BITS
+    if dim == 0:
+        return [1 << (bits-1-k) for k in range(bits)]
+    s,a,m = _SOBOL_PARAMS[dim-1]
+    m = list(m)
+    for k in range(s,bits):
+        new = m[k-s] ^ (m[k-s] << s)
+        for j in range(1,s):
+            if (a >> (s-1-j)) & 1: new ^= m[k-j] << j
+        m.append(new)
+    return [m[k] << (bits-1-k) for k in range(bits)]
+
+def _uniform(rs,shape):
+    #Works for RandomState and Generator alike
+    return rs.random_sample(shape) if hasattr(rs,'random_sample') else rs.random(shape)
+
+def _random_bits(rs,shape):
+    return _uniform(rs,shape) < 0.5
+
+def sobol(n,d,random_state=None,scramble=True):
+    """First n points of a d-dimensional (scrambled) Sobol sequence."""
+    if d > len(_SOBOL_PARAMS) + 1:
+        raise ValueError(f'sobol supports at most {len(_SOBOL_PARAMS)+1} dimensions')
+    rs = as_generator(random_state)
+    bits = _SOBOL_BITS
+    index = np.arange(n,dtype=np.int64)
+    gray = index ^ (index >> 1)
+    out = np.empty((n,d))
+    for dim in range(d):
+        v = _direction_numbers(dim)
+        shift = 0
+        if scramble:
+            #Random lower-triangular (unit diagonal) bit matrix applied to v
+            lower = np.tril(_random_bits(rs,(bits,bits)),-1) | np.eye(bits,dtype=bool)
+            rows = [sum(1 << (bits-1-j) for j in np.flatnonzero(lower[i])) for i in range(bits)]
+            v = [sum((bin(row & vk).count('1') & 1) << (bits-1-i) for i,row in enumerate(rows))
+                 for vk in v]
+            shift = sum(int(b) << k for k,b in enumerate(_random_bits(rs,bits)))
+        x = np.full(n,shift,dtype=np.int64)
+        for k in range(bits):
+            x ^= np.where((gray >> k) & 1,v[k],0)
+        out[:,dim] = (x + 0.5) / (1 << bits)
+    return out
+
+def latin_hypercube(n,d,random_state=None):
+    rs = as_generator(random_state)
+    strata = np.column_stack([rs.permutation(n) for _ in range(d)])
+    return (strata + _uniform(rs,(n,d))) / n
+
+def antithetic(n,d,random_state=None):
+    rs = as_generator(random_state)
+    half = (n + 1) // 2
+    u = _uniform(rs,(half,d))
+    return np.concatenate([u,1-u])[:n]
+
+def unit_samples(strategy,n,d,random_state=None):
+    """n points in the d-dimensional unit hypercube from a strategy."""
+    if strategy == 'sobol': return sobol(n,d,random_state)
+    if strategy == 'lhs': return latin_hypercube(n,d,random_state)
+    if strategy == 'antithetic': return antithetic(n,d,random_state)
+    raise ValueError(f'unknown sampling strategy: {strategy}')
+
+#%% Mapping to model inputs
+def draw_inputs(specs,shape,strategy,random_state=None):
+    """Draw each (kind, [a, b]) input spec with a hypercube strategy.
+
+    kind is 'uniform' ([min, max]) or 'normal' ([mean, sd]). strategy may
+    also be an array of unit points with one column per spec, either
+    (samples, specs) or shape + (specs,). Returns one array of `shape` per
+    spec; for a 2-D (scenarios, samples) shape, (samples, specs) points are
+    reused for every scenario.
+    """
+    if isinstance(strategy,str):
+        u = unit_samples(strategy,shape[-1],len(specs),random_state)
+    else:
+        u = np.asarray(strategy,dtype=np.float64)
+    draws = []
+    for j,(kind,(a,b)) in enumerate(specs):
+        col = u[...,j] if kind == 'uniform' else norm_ppf(u[...,j])
+        if kind == 'uniform': b = np.subtract(b,a)
+        arr = np.empty(shape)
+        arr[...] = a + b*col
+        draws.append(arr)
+    return draws
+
+#%% Convergence comparison
+def compare_strategies(num_runs=1024,repeats=20,reference_runs=2**20,
+                       strategies=STRATEGIES,seed=0,**params):
+    """Error of each sampling strategy at a given sample count.
+
+    Every strategy is run `repeats` times with independent streams spawned
+    from `seed`; the summary statistics (mean and QUANTILES of both
+    outputs) are compared with a Sobol reference run of reference_runs
+    samples. Returns a DataFrame of root-mean-square relative errors, one
+    row per strategy. params are update_df keyword arguments.
+    """
+    import pandas as pd
+    from model import run_model
+    from sweep import summarize
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(repeats+1)]
+    reference = summarize(run_model(num_runs=reference_runs,sampling='sobol',
+                                     random_state=rngs[-1],**params))
+    rows = {}
+    for strategy in strategies:
+        errors = {key:[] for key in reference}
+        for rng in rngs[:-1]:
+            summary = summarize(run_model(num_runs=num_runs,sampling=strategy,
+                                          random_state=rng,**params))
+            for key,ref in reference.items():
+                errors[key].append(summary[key]/ref - 1)
+        rows[strategy] = {key:np.sqrt(np.mean(np.square(err))) for key,err in errors.items()}
+    return pd.DataFrame.from_dict(rows,orient='index')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Global sensitivity analysis of the exposure model.
+
+sobol_indices estimates first-order and total Sobol indices of each
+uncertain input with Saltelli-style sample matrices: base matrices A and B
+plus, for every input i, A with column i taken from B. All N*(k+2) points
+go through run_model in a single vectorized call. tornado gives the cheap
+one-at-a-time alternative: every input at a low and a high quantile with
+the others held at their medians.
+"""
+
+import numpy as np
+
+from model import INPUTS, OUTPUTS, run_model
+from sampling import as_generator, sobol
+
+#Names of the uncertain inputs as shown on the dashboard
+LABELS = {'VENT':'Ventilation with outside air',
+          'DECAY':'Decay rate of virus infectivity',
+          'DEP':'Deposition to surfaces',
+          'OTHER':'Additional control measures',
+          'EFFOUT':'Mask efficiency (exhalation)',
+          'EMMFx':'Quanta emission rate: faculty',
+          'EMMSx':'Quanta emission rate: student',
+          'INFRATEF':'Infectious faculty-age people in community',
+          'INFRATES':'Infectious student-age people in community',
+          'EFFIN':'Mask efficiency (inhalation)',
+          'BRFx':'Inhalation rate: faculty',
+          'BRSx':'Inhalation rate: student'}
+
+def saltelli_points(num_base=1024,random_state=None):
+    """Unit points for A, B and every AB_i stacked in one (N*(k+2), k) array."""
+    k = len(INPUTS)
+    #One generator for both draws: an int seed would otherwise give A == B
+    rs = as_generator(random_state)
+    A = sobol(num_base,k,rs)
+    B = sobol(num_base,k,rs)
+    blocks = [A,B]
+    for i in range(k):
+        AB = A.copy()
+        AB[:,i] = B[:,i]
+        blocks.append(AB)
+    return np.concatenate(blocks)
+
+def sobol_indices(num_base=1024,random_state=None,**params):
+    """First-order (S1) and total (ST) Sobol indices of each input.
+
+    params are update_df keyword arguments; num_base is the number of rows
+    of each Saltelli matrix (a power of two). Uses the Saltelli (2010)
+    first-order and Jansen total-effect estimators. Returns a DataFrame
+    indexed by input column name with '<output>_S1' and '<output>_ST'.
+    """
+    import pandas as pd
+    k = len(INPUTS)
+    points = saltelli_points(num_base,random_state)
+    result = run_model(num_runs=len(points),sampling=points,**params)
+    table = {}
+    for fld in OUTPUTS:
+        f = np.asarray(result[fld]).reshape(k+2,num_base)
+        fA,fB,fAB = f[0],f[1],f[2:]
+        var = np.var(np.concatenate([fA,fB]))
+        if var == 0: var = np.nan
+        table[f'{fld}_S1'] = np.mean(fB*(fAB-fA),axis=1) / var
+        table[f'{fld}_ST'] = 0.5*np.mean((fA-fAB)**2,axis=1) / var
+    return pd.DataFrame(table,index=[name for name,_,_ in INPUTS])
+
+def tornado(low=0.05,high=0.95,**params):
+    """One-at-a-time swings of the outputs, largest first.
+
+    Every input is set to its `low` and `high` quantile while the others
+    stay at their medians. Returns a DataFrame indexed by input column name
+    with the base value and the low/high outputs and swing per output.
+    """
+    import pandas as pd
+    k = len(INPUTS)
+    points = np.full((1+2*k,k),0.5)
+    points[1+np.arange(k),np.arange(k)] = low
+    points[1+k+np.arange(k),np.arange(k)] = high
+    result = run_model(num_runs=len(points),sampling=points,**params)
+    table = {}
+    for fld in OUTPUTS:
+        f = np.asarray(result[fld])
+        table[f'{fld}_base'] = np.full(k,f[0])
+        table[f'{fld}_low'] = f[1:1+k]
+        table[f'{fld}_high'] = f[1+k:]
+        table[f'{fld}_swing'] = np.abs(f[1+k:]-f[1:1+k])
+    table = pd.DataFrame(table,index=[name for name,_,_ in INPUTS])
+    return table.sort_values(f'{OUTPUTS[0]}_swing',ascending=False)
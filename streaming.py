@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming (chunked) execution of the exposure model.
+
+stream_model evaluates the model in fixed-size chunks and folds each chunk
+into mergeable accumulators -- running moments and a relative-error
+quantile sketch -- so memory stays flat however many samples are drawn.
+Histogram counts for any bins are read off the sketch, so figures can pick
+their bins after the run. The result can be passed to summarize_output and
+update_figure in place of a DataFrame.
+"""
+
+import numpy as np
+
+from model import OUTPUTS, run_model
+from sampling import as_generator
+
+#%% Accumulators
+class Moments(object):
+    """Count, mean, variance (Chan/Welford), min and max of a stream."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self,values):
+        values = np.asarray(values)
+        if values.size == 0: return self
+        other = Moments()
+        other.count = values.size
+        other.mean = values.mean(dtype=np.float64)
+        other.m2 = np.square(values-other.mean,dtype=np.float64).sum()
+        other.min = float(values.min())
+        other.max = float(values.max())
+        return self.merge(other)
+
+    def merge(self,other):
+        n = self.count + other.count
+        if other.count == 0: return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta**2 * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min,other.min)
+        self.max = max(self.max,other.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+class QuantileSketch(object):
+    """Log-bucketed quantile sketch with bounded relative error.
+
+    Values in [min_value, max_value] fall in buckets whose bounds grow by
+    gamma = (1+a)/(1-a), so any quantile is returned within a relative
+    error `a` (relative_accuracy). Smaller values are counted as zero. The
+    bucket array has a fixed size and sketches merge by adding counts.
+    """
+    def __init__(self,relative_accuracy=0.001,min_value=1e-12,max_value=1.0):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self._imin = int(np.ceil(np.log(min_value) / self._log_gamma))
+        imax = int(np.ceil(np.log(max_value) / self._log_gamma))
+        self.counts = np.zeros(imax - self._imin + 1,dtype=np.int64)
+        self.zero_count = 0
+
+    def update(self,values):
+        values = np.asarray(values,dtype=np.float64).ravel()
+        small = values < self.min_value
+        self.zero_count += int(small.sum())
+        idx = np.ceil(np.log(values[~small]) / self._log_gamma).astype(np.int64)
+        np.clip(idx - self._imin,0,self.counts.size-1,out=idx)
+        self.counts += np.bincount(idx,minlength=self.counts.size)
+        return self
+
+    def merge(self,other):
+        if self.counts.shape != other.counts.shape or self.gamma != other.gamma:
+            raise ValueError('can only merge sketches with the same settings')
+        self.counts += other.counts
+        self.zero_count += other.zero_count
+        return self
+
+    @property
+    def count(self):
+        return self.zero_count + int(self.counts.sum())
+
+    def bucket_values(self):
+        #Representative value of each bucket: 2*gamma^i/(gamma+1)
+        i = np.arange(self.counts.size) + self._imin
+        return 2 * self.gamma**i / (self.gamma + 1)
+
+    def quantile(self,q):
+        q = np.asarray(q,dtype=np.float64)
+        counts = np.concatenate([[self.zero_count],self.counts])
+        values = np.concatenate([[0.0],self.bucket_values()])
+        cum = np.cumsum(counts)
+        rank = q * (cum[-1] - 1)
+        return values[np.searchsorted(cum,rank,side='right')]
+
+    def rebin(self,edges):
+        """Approximate counts of the sketched values in the given bins."""
+        values = np.concatenate([[0.0],self.bucket_values()])
+        weights = np.concatenate([[self.zero_count],self.counts])
+        counts,_ = np.histogram(values,bins=edges,weights=weights)
+        return counts.astype(np.int64)
+
+class OutputAccumulator(object):
+    """Moments and quantile sketch of one model output.
+
+    Mirrors the pandas Series calls used by the summaries: mean(),
+    quantile(q), min() and max().
+    """
+    def __init__(self,relative_accuracy=0.001):
+        self.moments = Moments()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def update(self,values):
+        self.moments.update(values)
+        self.sketch.update(values)
+        return self
+
+    def merge(self,other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def __len__(self):
+        return self.moments.count
+
+    def mean(self):
+        return self.moments.mean
+
+    def std(self):
+        return np.sqrt(self.moments.variance)
+
+    def min(self):
+        return self.moments.min
+
+    def max(self):
+        return self.moments.max
+
+    def quantile(self,q):
+        return np.clip(self.sketch.quantile(q),self.moments.min,self.moments.max)
+
+    def histogram(self,edges):
+        """Counts in arbitrary bins (from the sketch) and the bin edges."""
+        return self.sketch.rebin(edges),np.asarray(edges)
+
+class StreamResult(object):
+    """Accumulators for each model output, indexed like a DataFrame."""
+    def __init__(self,fields=OUTPUTS,**kwargs):
+        self.accumulators = {fld:OutputAccumulator(**kwargs) for fld in fields}
+
+    def __getitem__(self,fld):
+        return self.accumulators[fld]
+
+    def __len__(self):
+        return len(next(iter(self.accumulators.values())))
+
+    def update(self,result):
+        for fld,acc in self.accumulators.items():
+            acc.update(result[fld])
+        return self
+
+    def merge(self,other):
+        for fld,acc in self.accumulators.items():
+            acc.merge(other[fld])
+        return self
+
+#%% Execution
+def stream_model(num_runs=10**7,chunk_size=100000,random_state=None,
+                 dtype=np.float64,relative_accuracy=0.001,progress=None,**params):
+    """Evaluate the model over num_runs samples, chunk_size at a time.
+
+    params are update_df keyword arguments. Returns a StreamResult.
+    progress(result, done), if given, is called after every chunk with the
+    partial StreamResult and the number of samples folded in so far.
+    """
+    result = StreamResult(relative_accuracy=relative_accuracy)
+    random_state = as_generator(random_state)
+    for start in range(0,num_runs,chunk_size):
+        n = min(chunk_size,num_runs-start)
+        result.update(run_model(num_runs=n,dtype=dtype,random_state=random_state,**params))
+        if progress is not None: progress(result,start+n)
+    return result
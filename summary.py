@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics and histogram counts of the model outputs.
+
+Each output is sorted once; the mean, every requested quantile (linear
+interpolation, as np.quantile/pandas) and fixed-bin histogram counts are
+then read off the sorted array. StreamResult accumulators are summarized
+from their sketches instead. Figures are built from these pre-binned
+counts, so a few dozen bars travel to the browser rather than every sample.
+"""
+
+import numpy as np
+
+from model import OUTPUTS, QUANTILES
+from streaming import OutputAccumulator
+
+def _prepare(values):
+    if isinstance(values,OutputAccumulator): return values
+    return np.sort(np.asarray(values,dtype=np.float64).ravel())
+
+def _quantiles(prepared,quantiles):
+    if isinstance(prepared,OutputAccumulator): return prepared.quantile(quantiles)
+    pos = np.asarray(quantiles,dtype=np.float64) * (prepared.size - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1,prepared.size - 1)
+    return prepared[lo] + (prepared[hi] - prepared[lo]) * (pos - lo)
+
+def _counts(prepared,edges):
+    if isinstance(prepared,OutputAccumulator): return prepared.histogram(edges)[0]
+    #Bins are [a, b) except the last, which includes its right edge
+    idx = np.searchsorted(prepared,edges,side='left')
+    idx[-1] = np.searchsorted(prepared,edges[-1],side='right')
+    return np.diff(idx)
+
+def describe(values,quantiles=QUANTILES,edges=None):
+    """Count, mean, quantiles and (if edges are given) histogram counts.
+
+    values is an array of samples or a streaming.OutputAccumulator.
+    """
+    prepared = _prepare(values)
+    return {'count':len(prepared),
+            'mean':float(prepared.mean()),
+            'quantiles':_quantiles(prepared,quantiles),
+            'edges':edges,
+            'counts':None if edges is None else _counts(prepared,edges)}
+
+def describe_outputs(result,quantiles=QUANTILES,bins=40,upper=0.99,fields=OUTPUTS):
+    """describe() every output of a model run, sorting each only once.
+
+    The histogram bins split [0, x_max] into `bins` equal bins, where x_max
+    is the largest `upper` quantile over all fields, so the faculty and
+    student figures share an x-axis. Returns {field: describe() dict} with
+    'x_max' added.
+    """
+    prepared = {fld:_prepare(result[fld]) for fld in fields}
+    tops = {fld:float(_quantiles(p,[upper])[0]) for fld,p in prepared.items()}
+    x_max = max(tops.values())
+    edges = np.linspace(0,x_max if x_max > 0 else 1,bins+1)
+    stats = {}
+    for fld,p in prepared.items():
+        stats[fld] = {'count':len(p),
+                      'mean':float(p.mean()),
+                      'quantiles':_quantiles(p,quantiles),
+                      'edges':edges,
+                      'counts':_counts(p,edges),
+                      'x_max':x_max}
+    return stats
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized parameter sweeps over the classroom exposure model.
+
+A sweep takes a list of scenarios -- dicts of update_df keyword arguments,
+anything left out keeps its default -- and evaluates them together as a
+(scenarios x samples) array in one pass of model.run_model.
+
+    >>> scenarios = grid(ventilation_w_outside_air=[[2,2],[4,4],[6,6],[8,8]],
+    ...                  num_students=[10,20,40])
+    >>> table = run_sweep(scenarios)
+"""
+
+import inspect
+import itertools
+
+import numpy as np
+
+from model import OUTPUTS, QUANTILES, run_model, update_df
+from parallel import map_chunks, spawn_streams
+
+#Keyword arguments of update_df and their defaults
+DEFAULTS = {name:p.default for name,p in inspect.signature(update_df).parameters.items()
+            if name != 'random_state'}
+
+def grid(**axes):
+    """Cartesian product of the given parameter values, as a scenario list."""
+    names = list(axes)
+    return [dict(zip(names,combo)) for combo in itertools.product(*axes.values())]
+
+def stack_scenarios(scenarios):
+    """Turn a list of scenarios into run_model keyword arguments.
+
+    Scalar parameters become (scenarios, 1) columns and [min, max] (or
+    [mean, sd]) ranges become a pair of such columns, so they broadcast
+    against the samples axis. Raises ValueError for a parameter of the
+    wrong shape, e.g. a number where a range is expected.
+    """
+    for scenario in scenarios:
+        unknown = set(scenario) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f'unknown model parameter(s): {", ".join(sorted(unknown))}')
+    kwargs = {}
+    for name,default in DEFAULTS.items():
+        vals = np.asarray([s.get(name,default) for s in scenarios],dtype=float)
+        if vals.shape[1:] != ((2,) if isinstance(default,list) else ()):
+            raise ValueError(f'{name} must be ' + ('a [low, high] or [mean, sd] pair'
+                                                  if isinstance(default,list) else 'a number'))
+        if isinstance(default,list):
+            kwargs[name] = [vals[:,[0]],vals[:,[1]]]
+        else:
+            kwargs[name] = vals[:,None]
+    return kwargs
+
+def evaluate(scenarios,num_runs=10000,dtype=np.float64,random_state=None,sampling='random'):
+    """Run every scenario at once; returns a ModelResult of 2-D arrays.
+
+    sampling is passed to run_model (see sampling.draw_inputs).
+    """
+    scenarios = list(scenarios)
+    return run_model(**stack_scenarios(scenarios),
+                     num_runs=(len(scenarios),num_runs),dtype=dtype,
+                     random_state=random_state,sampling=sampling)
+
+def summarize(result,quantiles=QUANTILES):
+    """Per-scenario mean and quantiles of the semester outputs.
+
+    Returns a dict of arrays keyed like 'PFsemester_mean' and
+    'PFsemester_q0.05', one value per scenario (row of `result`).
+    """
+    summary = {}
+    for fld in OUTPUTS:
+        vals = np.asarray(result[fld])
+        summary[f'{fld}_mean'] = vals.mean(axis=-1)
+        for q,qvals in zip(quantiles,np.quantile(vals,quantiles,axis=-1)):
+            summary[f'{fld}_q{q:g}'] = qvals
+    return summary
+
+def _summarize_chunk(task):
+    chunk,num_runs,quantiles,dtype,rng = task
+    return summarize(evaluate(chunk,num_runs,dtype,rng),quantiles)
+
+def run_sweep(scenarios,num_runs=10000,quantiles=QUANTILES,chunk_size=64,
+              dtype=np.float64,seed=None,workers=1,backend='processes'):
+    """Evaluate scenarios and return one row of summary statistics each.
+
+    Scenarios are evaluated `chunk_size` at a time to bound memory at about
+    chunk_size * num_runs * 12 values; chunks are spread over `workers`
+    processes (see parallel.map_chunks), each with its own random stream
+    spawned from `seed`. The returned DataFrame holds the varied parameters
+    followed by the columns produced by summarize().
+    """
+    import pandas as pd
+    scenarios = list(scenarios)
+    chunks = [scenarios[start:start+chunk_size]
+              for start in range(0,len(scenarios),chunk_size)]
+    tasks = [(chunk,num_runs,quantiles,dtype,rng)
+             for chunk,rng in zip(chunks,spawn_streams(seed,len(chunks)))]
+    parts = map_chunks(_summarize_chunk,tasks,workers,backend)
+    varied = [name for name in DEFAULTS if any(name in s for s in scenarios)]
+    table = pd.DataFrame({name:[s.get(name,DEFAULTS[name]) for s in scenarios]
+                          for name in varied})
+    for key in (parts[0] if parts else {}):
+        table[key] = np.concatenate([p[key] for p in parts])
+    return table
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""The JSON scenario API: validation, limits and request coalescing."""
+
+import threading
+
+import numpy as np
+import pytest
+from flask import Flask
+
+import api
+
+@pytest.fixture
+def client():
+    return api.register(Flask(__name__)).test_client()
+
+@pytest.mark.parametrize('body',[
+    {'ventilation_w_outside_air':4},
+    {'ventilation_w_outside_air':[4]},
+    {'num_students':[10,20]},
+    {'ventilation_w_outside_air':[4,1]},
+    {'quanta_emission_rate_student':[0.69,-0.1]},
+    {'no_such_parameter':1},
+    {'scenarios':[{}]*2000,'num_runs':10000},
+    {'scenarios':[{}]*200,'num_runs':10000,'samples':True},
+    {'scenarios':[{}],'num_runs':0},
+])
+def test_invalid_requests_get_400(client,body):
+    response = client.post('/api/scenarios',json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+def test_scenarios(client):
+    response = client.post('/api/scenarios',json={'scenarios':[{'num_students':10},{'num_students':40}],
+                                                  'num_runs':2000,'samples':True})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['num_runs'] == 2000 and len(body['results']) == 2
+    means = [r['PSsemester']['mean'] for r in body['results']]
+    assert 0 < means[0] < means[1] < 1
+    assert body['results'][0]['samples']['PFsemester']['shape'] == [2000]
+
+class RecordingCoalescer(api.Coalescer):
+    #Records the scenario count of every evaluation
+    def __init__(self,**kwargs):
+        super().__init__(**kwargs)
+        self.evaluated = []
+
+    def _evaluate(self,scenarios,num_runs):
+        self.evaluated.append(len(scenarios))
+        return super()._evaluate(scenarios,num_runs)
+
+def _submit_together(coalescer,requests):
+    results = [None]*len(requests)
+    def run(i):
+        try:
+            results[i] = coalescer.submit(*requests[i])
+        except Exception as err:
+            results[i] = err
+    threads = [threading.Thread(target=run,args=(i,)) for i in range(len(requests))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results
+
+def test_concurrent_requests_are_coalesced():
+    coalescer = RecordingCoalescer(max_wait=0.5)
+    results = _submit_together(coalescer,[([{'num_students':n}]*k,1000) for n,k in ((10,1),(20,2),(30,3))])
+    assert [r['PSsemester'].shape for r in results] == [(1,1000),(2,1000),(3,1000)]
+    assert sum(coalescer.evaluated) == 6 and len(coalescer.evaluated) < 3
+
+def test_batches_are_bounded():
+    coalescer = RecordingCoalescer(max_wait=0.5,max_samples=3000)
+    results = _submit_together(coalescer,[([{}]*2,1000),([{}]*2,1000)])
+    assert [r['PFsemester'].shape for r in results] == [(2,1000),(2,1000)]
+    assert max(coalescer.evaluated) == 2
+
+def test_a_failing_request_does_not_fail_its_batch():
+    coalescer = RecordingCoalescer(max_wait=0.5)
+    bad = [{'quanta_emission_rate_student':[0.69,-0.1]}]
+    good,failed = _submit_together(coalescer,[([{'num_students':20}],1000),(bad,1000)])
+    assert coalescer.evaluated[0] == 2
+    assert good['PSsemester'].shape == (1,1000) and np.all(good['PSsemester'] > 0)
+    assert isinstance(failed,ValueError)
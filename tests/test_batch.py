@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Batch runner: interrupted and resumed runs match uninterrupted ones."""
+
+import pandas as pd
+import pytest
+
+from batch import run_batch, section_scenarios
+
+class Interrupted(Exception):
+    pass
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / 'catalog.csv'
+    pd.DataFrame({'section_id':[f's{i}' for i in range(10)],
+                  'num_students':[10+5*i for i in range(10)],
+                  'surface_area':[600+50*i for i in range(10)],
+                  'ventilation_w_outside_air_min':[1]*5 + [None]*5,
+                  'ventilation_w_outside_air_max':[3]*5 + [None]*5}).to_csv(path,index=False)
+    return str(path)
+
+def _interrupt_after(rows):
+    def log(message):
+        if int(message.split()[0]) >= rows: raise Interrupted()
+    return log
+
+def test_section_scenarios(catalog):
+    scenarios = section_scenarios(pd.read_csv(catalog),{'num_faculty':2})
+    assert scenarios[0] == {'num_faculty':2,'num_students':10,'surface_area':600,
+                            'ventilation_w_outside_air':[1,3]}
+    assert 'ventilation_w_outside_air' not in scenarios[9]
+
+def test_resumed_csv_matches_uninterrupted(catalog,tmp_path):
+    expected = str(tmp_path / 'expected.csv')
+    assert run_batch(catalog,expected,num_runs=500,chunk_size=3,seed=4) == 10
+    output = str(tmp_path / 'output.csv')
+    with pytest.raises(Interrupted):
+        run_batch(catalog,output,num_runs=500,chunk_size=3,seed=4,log=_interrupt_after(6))
+    #A chunk half-written when the process died is discarded on resume
+    with open(output,'a') as f:
+        f.write('s6,0.1,0.2')
+    assert run_batch(catalog,output,num_runs=500,chunk_size=3,seed=4) == 4
+    with open(output) as f, open(expected) as g:
+        assert f.read() == g.read()
+
+def test_resumed_parquet_matches_uninterrupted(catalog,tmp_path):
+    pytest.importorskip('pyarrow')
+    expected = str(tmp_path / 'expected.parquet')
+    run_batch(catalog,expected,num_runs=500,chunk_size=3,seed=4)
+    output = str(tmp_path / 'output.parquet')
+    with pytest.raises(Interrupted):
+        run_batch(catalog,output,num_runs=500,chunk_size=3,seed=4,log=_interrupt_after(3))
+    assert run_batch(catalog,output,num_runs=500,chunk_size=3,seed=4) == 7
+    assert pd.read_parquet(output).equals(pd.read_parquet(expected))
+
+def test_changed_settings_refuse_to_resume(catalog,tmp_path):
+    output = str(tmp_path / 'output.csv')
+    with pytest.raises(Interrupted):
+        run_batch(catalog,output,num_runs=500,chunk_size=3,log=_interrupt_after(3))
+    with pytest.raises(SystemExit):
+        run_batch(catalog,output,num_runs=1000,chunk_size=3)
+    assert run_batch(catalog,output,num_runs=1000,chunk_size=3,restart=True) == 10
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Result cache: keys, LRU eviction and the shared SQLite store."""
+
+import pickle
+import sqlite3
+
+import cache
+
+def test_keys_ignore_order_and_number_types():
+    a = {'num_students':10,'ventilation_w_outside_air':[1,4]}
+    b = {'ventilation_w_outside_air':(1.0,4.0),'num_students':10.0}
+    assert cache.cache_key(a) == cache.cache_key(b)
+    assert cache.cache_key(a) != cache.cache_key(dict(a,num_students=11))
+    assert 0 <= cache.seed_for(cache.cache_key(a)) < 2**32
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = cache.MemoryBackend(maxsize=2)
+    backend.set('a',1); backend.set('b',2)
+    backend.get('a')
+    backend.set('c',3)
+    assert backend.get('b') is cache._MISSING
+    assert (backend.get('a'),backend.get('c')) == (1,3)
+
+def test_sqlite_backend_is_shared_and_evicts(tmp_path):
+    path = str(tmp_path / 'results.db')
+    first = cache.SQLiteBackend(path,maxsize=2,touch_interval=0)
+    second = cache.SQLiteBackend(path,maxsize=2,touch_interval=0)
+    first.set('a',('faculty','student'))
+    assert second.get('a') == ('faculty','student')
+    second.set('b',('x','y'))
+    first.get('a')
+    first.set('c',('z','w'))
+    assert len(second) == 2
+    assert second.get('b') is cache._MISSING
+    assert first.get('a') == ('faculty','student')
+
+def test_sqlite_backend_never_unpickles(tmp_path):
+    path = str(tmp_path / 'results.db')
+    backend = cache.SQLiteBackend(path)
+    with sqlite3.connect(path) as con:
+        con.execute('INSERT INTO results VALUES (?,?,?)',('p',pickle.dumps(('x','y')),0.0))
+    assert backend.get('p') is cache._MISSING
+
+def test_get_or_compute_computes_once_with_a_stable_seed(tmp_path):
+    seeds = []
+    def compute(seed):
+        seeds.append(seed)
+        return ('faculty','student')
+    params = {'num_students':10}
+    results = cache.ResultCache(maxsize=4,path=str(tmp_path / 'results.db'))
+    assert results.get_or_compute(params,compute) == ('faculty','student')
+    assert results.get_or_compute(params,compute) == ('faculty','student')
+    assert seeds == [cache.seed_for(cache.cache_key(params))]
+    assert (results.hits,results.misses) == (1,1)
+    #A second worker finds the result in the shared store
+    other = cache.ResultCache(maxsize=4,path=str(tmp_path / 'results.db'))
+    assert other.get_or_compute(params,compute) == ('faculty','student')
+    assert len(seeds) == 1
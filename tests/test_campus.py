@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Campus risk: enrollment matrices, both combination paths, shared draws."""
+
+import numpy as np
+import pytest
+
+import campus
+
+SEED = 12345
+
+def test_campus_sparse_and_numpy_paths_agree():
+    pytest.importorskip('scipy')
+    rs = np.random.RandomState(SEED)
+    num_people,num_sections = 500,60
+    people = rs.randint(0,num_people,2000)
+    sections = rs.randint(0,num_sections,2000)
+    enrollment = campus.Enrollment.from_pairs(people,sections,np.arange(num_sections))
+    log_survival = np.log1p(-rs.uniform(0,0.1,(num_sections,300)))
+    sparse = campus.combined_log_survival(enrollment,log_survival,100,400)
+    dense = campus.combined_log_survival(enrollment,log_survival,100,400,matrix=False)
+    np.testing.assert_allclose(sparse,dense,rtol=1e-13,atol=1e-15)
+
+def test_from_pairs():
+    enrollment = campus.Enrollment.from_pairs(['x','y','x','x'],['s2','s1','s1','s2'],['s1','s2','s3'])
+    assert list(enrollment.people) == ['x','y']
+    assert list(enrollment.counts()) == [2,1]
+    assert list(enrollment.indices) == [0,1,0]
+    with pytest.raises(ValueError):
+        campus.Enrollment.from_pairs(['x'],['s9'],['s1','s2'])
+
+def test_identical_rooms_share_every_draw():
+    #With fixed room inputs two identical sections differ in nothing drawn
+    room = dict(ventilation_w_outside_air=[2,2],deposition_to_surface=[0.5,0.5],num_students=30)
+    log_survival = campus.section_log_survival([room,room,dict(room,num_students=60)],2000,seed=1,chunk_size=2)
+    ls = log_survival['PSsemester']
+    np.testing.assert_array_equal(ls[0],ls[1])
+    #The third section is in another chunk but sees the same campus draws
+    assert np.all(ls[2] < ls[0])
+
+def test_person_risk_combines_sections():
+    log_survival = np.log1p(-np.array([[0.1,0.2],[0.5,0.5]]))
+    enrollment = campus.Enrollment.from_pairs([0,0,1],[0,1,1],[0,1])
+    risk = campus.person_risk(enrollment,log_survival,quantiles=(0.5,))
+    np.testing.assert_allclose(risk['mean'],[1-(0.9*0.5+0.8*0.5)/2,0.5])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Per-call random generators: reproducibility, thread safety and draws."""
+
+import threading
+
+import numpy as np
+
+from incremental import IncrementalModel
+from model import get_random, run_model
+from sampling import as_generator
+from streaming import stream_model
+
+def test_int_seed_is_a_fresh_generator():
+    a = run_model(num_runs=1000,random_state=7)['PSsemester']
+    b = run_model(num_runs=1000,random_state=np.random.default_rng(7))['PSsemester']
+    np.testing.assert_array_equal(a,b)
+    assert as_generator(None) is not as_generator(None)
+
+def test_unseeded_calls_differ():
+    a = run_model(num_runs=1000)['PSsemester']
+    b = run_model(num_runs=1000)['PSsemester']
+    assert not np.array_equal(a,b)
+
+def test_concurrent_calls_with_one_seed_agree():
+    results = [None]*8
+    def run(i):
+        results[i] = run_model(num_runs=20000,random_state=11)['PSsemester']
+    threads = [threading.Thread(target=run,args=(i,)) for i in range(len(results))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    for result in results[1:]:
+        np.testing.assert_array_equal(result,results[0])
+
+def test_get_random_draws_like_randomstate_uniform():
+    np.testing.assert_array_equal(get_random([1,4],(3,500),np.random.RandomState(5)),
+                                  np.random.RandomState(5).uniform(1,4,(3,500)))
+
+def test_reversed_range_is_accepted_on_every_path():
+    #As the original np.random.uniform(4, 1, n): values still lie in [1, 4]
+    params = dict(ventilation_w_outside_air=[4,1])
+    small = IncrementalModel(num_runs=1000,seed=0).evaluate(**params)
+    direct = run_model(num_runs=1000,random_state=np.random.RandomState(0),kernel='reference',**params)
+    np.testing.assert_array_equal(small['PSsemester'],direct['PSsemester'])
+    streamed = stream_model(num_runs=4000,chunk_size=1000,random_state=0,**params)
+    assert len(streamed) == 4000
+    assert np.all((get_random([4,1],1000,0) >= 1) & (get_random([4,1],1000,0) <= 4))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Incremental re-evaluation against the reference pipeline."""
+
+import numpy as np
+
+from incremental import IncrementalModel, Sessions, downstream
+from model import OUTPUTS, run_model
+
+SEED = 12345
+SCENARIO = dict(num_students=25,surface_area=700,ventilation_w_outside_air=[2,5])
+
+def test_incremental_is_bit_identical_to_reference():
+    model = IncrementalModel(num_runs=5000,seed=SEED)
+    for params in ({},dict(num_students=40),dict(num_students=40,surface_area=500),SCENARIO):
+        result = model.evaluate(**params)
+        expected = run_model(num_runs=5000,random_state=np.random.RandomState(SEED),kernel='reference',**params)
+        for fld in OUTPUTS:
+            np.testing.assert_array_equal(result[fld],expected[fld])
+
+def test_incremental_recomputes_only_downstream_stages():
+    model = IncrementalModel(num_runs=1000,seed=SEED)
+    model.evaluate()
+    model.evaluate(num_students=40)
+    assert model.recomputed == ['nPF','nPS','PFsemester','PSsemester']
+
+
+def test_unchanged_parameters_recompute_nothing():
+    model = IncrementalModel(num_runs=1000,seed=SEED)
+    first = model.evaluate(**SCENARIO)['PSsemester'].copy()
+    second = model.evaluate(**SCENARIO)['PSsemester']
+    assert model.recomputed == []
+    np.testing.assert_array_equal(first,second)
+
+def test_downstream():
+    assert downstream(['num_class_periods']) == ['PFsemester','PSsemester']
+
+def test_sessions_are_kept_per_user_and_evicted_oldest_first():
+    sessions = Sessions(maxsize=2)
+    a = sessions.model('a',1000)
+    sessions.model('b',1000)
+    assert sessions.model('a',1000) is a
+    sessions.model('c',1000)
+    assert sessions.model('a',1000) is a
+    assert set(key[0] for key in sessions._models) == {'a','c'}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Background jobs: progress, cancellation and per-user limits."""
+
+import threading
+
+import pytest
+
+import jobs
+
+def _wait(job,timeout=10):
+    job.future.exception(timeout=timeout)
+    return job
+
+def _blocking(release,started=None):
+    #A job that reports progress until `release` is set
+    def func(job):
+        if started is not None: started.set()
+        while not release.wait(0.01):
+            job.report(0.5,'partial')
+        return 'done'
+    return func
+
+def test_job_reports_progress_and_result():
+    queue = jobs.JobQueue(workers=1)
+    release,started = threading.Event(),threading.Event()
+    job = queue.submit(_blocking(release,started),user='u')
+    started.wait(5)
+    job.report(0.25,'partial')
+    assert job.state == 'running' and job.partial == 'partial'
+    release.set()
+    _wait(job)
+    assert (job.state,job.progress,job.result) == ('done',1.0,'done')
+    assert queue.get(job.id) is job
+
+def test_failed_job_keeps_its_error():
+    queue = jobs.JobQueue(workers=1)
+    job = _wait(queue.submit(lambda job: 1/0))
+    assert job.state == 'failed' and isinstance(job.error,ZeroDivisionError)
+
+def test_cancel_stops_a_running_job():
+    queue = jobs.JobQueue(workers=1)
+    started = threading.Event()
+    job = queue.submit(_blocking(threading.Event(),started),user='u')
+    started.wait(5)
+    queue.cancel(job.id)
+    _wait(job)
+    assert job.state == 'cancelled'
+
+def test_new_job_supersedes_the_previous_one():
+    queue = jobs.JobQueue(workers=2)
+    release = threading.Event()
+    first = queue.submit(_blocking(threading.Event()),user='u')
+    second = queue.submit(_blocking(release),user='u',supersedes=first.id)
+    _wait(first)
+    assert first.state == 'cancelled'
+    release.set()
+    assert _wait(second).state == 'done'
+
+def test_per_user_limit():
+    queue = jobs.JobQueue(workers=1,per_user=2)
+    release = threading.Event()
+    running = [queue.submit(_blocking(release),user='u') for _ in range(2)]
+    with pytest.raises(jobs.JobLimitError):
+        queue.submit(_blocking(release),user='u')
+    other = queue.submit(_blocking(release),user='v')
+    release.set()
+    for job in running + [other]:
+        assert _wait(job).state == 'done'
+    assert _wait(queue.submit(_blocking(release),user='u')).state == 'done'
+
+def test_from_environ():
+    assert jobs.from_environ({'JOB_WORKERS':'0'}) is None
+    queue = jobs.from_environ({'JOB_WORKERS':'3','JOB_USER_LIMIT':'5'})
+    assert (queue.workers,queue.per_user) == (3,5)
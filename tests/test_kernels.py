@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Fused kernels against extended precision and the reference pipeline."""
+
+import numpy as np
+import pytest
+
+import kernels
+from model import OUTPUTS, run_model
+
+SEED = 12345
+SCENARIO = dict(num_students=25,surface_area=700,ventilation_w_outside_air=[2,5])
+
+@pytest.mark.parametrize('kernel',['numpy','numba'])
+def test_fused_kernels_match_extended_precision(kernel):
+    if kernel == 'numba': pytest.importorskip('numba')
+    assert kernels.check_kernel(kernel,num_runs=20000,seed=SEED) <= 1
+    assert kernels.check_kernel(kernel,num_runs=20000,seed=SEED,**SCENARIO) <= 1
+
+@pytest.mark.parametrize('kernel',['numpy','numba'])
+def test_fused_kernels_match_reference(kernel):
+    if kernel == 'numba': pytest.importorskip('numba')
+    expected = run_model(random_state=np.random.RandomState(SEED),kernel='reference',**SCENARIO)
+    result = run_model(random_state=np.random.RandomState(SEED),kernel=kernel,**SCENARIO)
+    for fld in OUTPUTS:
+        np.testing.assert_allclose(result[fld],expected[fld],rtol=1e-7)
+
+
+def test_default_kernel_is_deterministic():
+    assert kernels._from_environ({}) == 'numpy'
+    a = run_model(num_runs=2000,random_state=1)['PSsemester']
+    b = run_model(num_runs=2000,random_state=1,kernel='numpy')['PSsemester']
+    np.testing.assert_array_equal(a,b)
+
+@pytest.mark.parametrize('name',['reference','auto','Numpy'])
+def test_unknown_model_kernel_is_rejected(name):
+    with pytest.raises(ValueError):
+        kernels._from_environ({'MODEL_KERNEL':name})
+
+def test_array_parameters_use_numpy():
+    result = run_model(num_runs=(2,500),num_students=np.array([[10],[20]]),random_state=1,kernel='fastest')
+    assert result['PSsemester'].shape == (2,500)
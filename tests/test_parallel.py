@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Parallel execution: output is bit-identical for any worker count."""
+
+import numpy as np
+import pytest
+
+from parallel import imap_chunks, parallel_model
+from sweep import run_sweep
+
+BACKENDS = [(1,'processes'),(2,'processes'),(3,'processes'),(2,'dask')]
+
+def _square(x):
+    return x*x
+
+@pytest.mark.parametrize('workers,backend',BACKENDS)
+def test_parallel_model_is_independent_of_workers(workers,backend):
+    if backend == 'dask': pytest.importorskip('dask')
+    expected = parallel_model(60000,seed=3,chunk_size=7000,workers=1)
+    result = parallel_model(60000,seed=3,chunk_size=7000,workers=workers,backend=backend)
+    assert len(result['PSsemester']) == 60000
+    for fld in ('PFsemester','PSsemester'):
+        np.testing.assert_array_equal(result[fld],expected[fld])
+
+@pytest.mark.parametrize('workers,backend',BACKENDS)
+def test_streamed_parallel_model_is_independent_of_workers(workers,backend):
+    if backend == 'dask': pytest.importorskip('dask')
+    expected = parallel_model(60000,seed=3,chunk_size=7000,workers=1,stream=True)['PSsemester']
+    result = parallel_model(60000,seed=3,chunk_size=7000,workers=workers,backend=backend,stream=True)['PSsemester']
+    assert len(result) == 60000
+    assert result.mean() == expected.mean()
+    np.testing.assert_array_equal(result.sketch.counts,expected.sketch.counts)
+
+def test_imap_chunks_keeps_order_with_few_in_flight():
+    assert list(imap_chunks(_square,iter(range(20)),workers=2,max_pending=3)) == [x*x for x in range(20)]
+
+def test_run_sweep_is_independent_of_workers():
+    scenarios = [{'num_students':n} for n in (5,10,20,40)]
+    expected = run_sweep(scenarios,num_runs=2000,chunk_size=1,seed=1)
+    result = run_sweep(scenarios,num_runs=2000,chunk_size=1,seed=1,workers=2)
+    assert result.equals(expected)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Unit-hypercube samplers and their mapping onto the model inputs."""
+
+import numpy as np
+import pytest
+
+from model import INPUTS, run_model
+from sampling import antithetic, draw_inputs, latin_hypercube, norm_ppf, sobol
+
+D = len(INPUTS)
+
+def test_sobol_points_are_balanced():
+    points = sobol(1024,D,random_state=0)
+    assert points.shape == (1024,D)
+    assert np.all((points > 0) & (points < 1))
+    #Every dyadic interval of width 1/16 holds exactly 1024/16 points, per dimension
+    for dim in range(D):
+        assert np.all(np.bincount((points[:,dim]*16).astype(int),minlength=16) == 64)
+    assert not np.array_equal(points,sobol(1024,D,random_state=1))
+
+def test_latin_hypercube_has_one_point_per_stratum():
+    points = latin_hypercube(100,D,random_state=0)
+    for dim in range(D):
+        assert sorted((points[:,dim]*100).astype(int)) == list(range(100))
+
+def test_antithetic_points_are_mirrored():
+    points = antithetic(100,D,random_state=0)
+    np.testing.assert_allclose(points[:50] + points[50:],1.0)
+
+def test_norm_ppf():
+    np.testing.assert_allclose(norm_ppf([0.025,0.5,0.8413447460685429,0.999]),
+                               [-1.959963984540054,0,1,3.090232306167813],rtol=2e-9,atol=1e-12)
+
+def test_draw_inputs_maps_ranges():
+    u = np.array([[0.0,0.5],[0.5,0.8413447460685429]])
+    uniform,normal = draw_inputs([('uniform',[2,4]),('normal',[1,0.5])],(2,),u)
+    np.testing.assert_allclose(uniform,[2,3])
+    np.testing.assert_allclose(normal,[1,1.5],rtol=1e-8)
+
+@pytest.mark.parametrize('sampling',['sobol','lhs','antithetic'])
+def test_strategies_agree_with_random_sampling(sampling):
+    mean = run_model(num_runs=4096,sampling=sampling,random_state=0)['PSsemester'].mean()
+    reference = run_model(num_runs=200000,random_state=0)['PSsemester'].mean()
+    assert abs(mean/reference - 1) < 0.05
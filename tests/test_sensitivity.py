@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Sobol sensitivity indices and their Saltelli sample matrices."""
+
+import numpy as np
+
+from model import INPUTS
+from sensitivity import saltelli_points, sobol_indices, tornado
+
+def test_int_seed_gives_distinct_base_matrices():
+    k = len(INPUTS)
+    points = saltelli_points(64,random_state=1).reshape(k+2,64,k)
+    assert not np.array_equal(points[0],points[1])
+
+def test_int_seed_gives_non_degenerate_indices():
+    table = sobol_indices(num_base=256,random_state=1)
+    assert np.all(np.isfinite(table.values))
+    assert table['PSsemester_ST'].max() > 0.1
+    np.testing.assert_array_equal(table.values,sobol_indices(num_base=256,random_state=1).values)
+
+def test_fixed_inputs_have_no_effect():
+    #additional_control_measures and breathing_rate_student default to [x, x]
+    table = sobol_indices(num_base=512,random_state=0)
+    for name in ('OTHER','BRSx'):
+        assert table.loc[name,'PSsemester_ST'] == 0
+        assert table.loc[name,'PFsemester_ST'] == 0
+
+def test_indices_are_plausible():
+    table = sobol_indices(num_base=1024,random_state=0)
+    for fld in ('PFsemester','PSsemester'):
+        assert table[f'{fld}_ST'].min() >= 0
+        assert 0.5 < table[f'{fld}_S1'].sum() < 1.2
+        assert np.all(table[f'{fld}_ST'] >= table[f'{fld}_S1'] - 0.05)
+    #Student emissions drive the risk of a room full of students
+    assert table['PSsemester_ST'].idxmax() == 'EMMSx'
+
+def test_tornado_is_sorted_with_zero_swing_for_fixed_inputs():
+    table = tornado()
+    swings = table['PFsemester_swing'].values
+    assert np.all(np.diff(swings) <= 0)
+    assert table.loc['OTHER','PFsemester_swing'] == 0
+    assert table['PFsemester_base'].nunique() == 1
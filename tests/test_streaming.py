@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Streaming accumulators: merging chunks matches one pass over all samples."""
+
+import numpy as np
+
+from model import run_model
+from streaming import Moments, QuantileSketch, StreamResult, stream_model
+from summary import describe, describe_outputs
+
+def _chunks(values,sizes):
+    return np.split(values,np.cumsum(sizes)[:-1])
+
+def test_moments_merge_matches_one_pass():
+    values = np.random.default_rng(0).lognormal(-4,1,10000)
+    merged = Moments()
+    for chunk in _chunks(values,[1,999,3000,6000]):
+        merged.merge(Moments().update(chunk))
+    assert merged.count == values.size
+    np.testing.assert_allclose(merged.mean,values.mean(),rtol=1e-12)
+    np.testing.assert_allclose(merged.variance,values.var(ddof=1),rtol=1e-10)
+    assert (merged.min,merged.max) == (values.min(),values.max())
+
+def test_sketch_merge_is_exact_and_quantiles_within_accuracy():
+    values = np.random.default_rng(1).lognormal(-4,1,20000)
+    whole = QuantileSketch(0.001).update(values)
+    merged = QuantileSketch(0.001)
+    for chunk in _chunks(values,[5000,15000]):
+        merged.merge(QuantileSketch(0.001).update(chunk))
+    np.testing.assert_array_equal(merged.counts,whole.counts)
+    q = np.array([0.05,0.5,0.95])
+    np.testing.assert_allclose(merged.quantile(q),np.quantile(values,q,method='lower'),rtol=0.001)
+
+def test_stream_model_summaries_match_in_memory_run():
+    streamed = stream_model(num_runs=40000,chunk_size=7000,random_state=3)
+    #The same draws, chunk by chunk from one generator, kept in memory
+    rng = np.random.default_rng(3)
+    parts = [run_model(num_runs=min(7000,40000-start),random_state=rng) for start in range(0,40000,7000)]
+    assert len(streamed) == 40000
+    for fld in ('PFsemester','PSsemester'):
+        a,b = describe(streamed[fld]),describe(np.concatenate([p[fld] for p in parts]))
+        np.testing.assert_allclose(a['mean'],b['mean'],rtol=1e-12)
+        np.testing.assert_allclose(a['quantiles'],b['quantiles'],rtol=0.003)
+
+def test_figure_counts_come_from_the_sketch():
+    stats = describe_outputs(StreamResult().update(run_model(num_runs=20000,random_state=4)))
+    direct = describe_outputs(run_model(num_runs=20000,random_state=4))
+    for fld,s in stats.items():
+        assert s['counts'].sum() <= 20000
+        assert np.abs(s['counts'] - direct[fld]['counts']).sum() < 0.05*20000
@@ -3,109 +3,68 @@
 # Run this app with `python app.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
 
+import time
+_import_started = time.perf_counter()
+import os
+import uuid
+
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
+from dash import dcc, html
 from dash.dependencies import Input, Output, State
-import plotly.express as px
 
-import pandas as pd
 import numpy as np
 
+import api
+import cache
+import incremental
+import jobs
+import kernels
+import metrics
+import sensitivity
+from model import QUANTILES, get_random, get_normal, run_model, update_df
+from streaming import stream_model
+from summary import describe, describe_outputs
+
+#Runs up to SYNC_RUNS samples are computed within the request; larger ones
+#become background jobs that the page polls (see jobs.py)
+RUN_OPTIONS = (10000,100000,1000000,10000000)
+SYNC_RUNS = 10000
+JOB_TIMEOUT = 600
+#Every page run draws from the same seed (common random numbers), so the
+#results of two input sets differ by the inputs rather than by sampling noise
+COMMON_SEED = 0
+
 #%% Functions
-def get_random(var,n=10000):
-    return np.random.uniform(*var+[n])
-
-def get_normal(var,n=10000):
-    return np.random.normal(*var+[n])
-
-def update_df(surface_area = 900,
-              height = 10,
-              num_faculty = 1,
-              num_students = 10,
-              duration = 75,
-              num_class_periods = 26,
-              breathing_rate_faculty = [0.027,0.029],
-              breathing_rate_student = [0.012,0.012],
-              ventilation_w_outside_air = [1,4],
-              decay_rate_of_virus = [0,1.0],
-              deposition_to_surface = [0.3,1.5],
-              additional_control_measures = [0,0],
-              quanta_emission_rate_faculty = [1.5,0.71],
-              quanta_emission_rate_student = [0.69,0.71],
-              exhalation_mask_efficiency = [0.4,0.6],
-              inhalation_mask_efficiency = [0.3,0.5],
-              background_infection_rate_faculty = [0.0070,0.0140],
-              background_infection_rate_student = [0.0070,0.0140]):
-    #Create dataframe of 10,000 runs
-    num_runs = 10000
-    df = pd.DataFrame(index=np.arange(num_runs))
-    df['VENT']  = get_random(ventilation_w_outside_air,num_runs)
-    df['DECAY'] = get_random(decay_rate_of_virus,num_runs)
-    df['DEP']   = get_random(deposition_to_surface,num_runs)
-    df['OTHER'] = get_random(additional_control_measures,num_runs)
-    df['L']     = df['VENT'] + df['DECAY'] + df['DEP'] + df['OTHER']
-    df['LDUR'] = df['L'] * duration / 60
-    df['VOL']   = surface_area * height*0.305**3
-    df['EFFOUT'] = get_random(exhalation_mask_efficiency,num_runs)
-    df['EMMFx']  = get_normal(quanta_emission_rate_faculty,num_runs)
-    df['EMMSx']  = get_normal(quanta_emission_rate_student,num_runs)
-    df['EMMF'] = 10**df['EMMFx']
-    df['EMMS'] = 10**df['EMMSx']
-    df['INFRATEF'] = get_random(background_infection_rate_faculty,num_runs)
-    df['INFRATES'] = get_random(background_infection_rate_student,num_runs)
-    df['CONCF'] = df['EMMF']*(1-df['EFFOUT'])/(df['L']*df['VOL'])*(1-1/df['LDUR']*(1-np.exp(-df['LDUR'])))
-    df['CONCS'] = df['EMMS']*(1-df['EFFOUT'])/(df['L']*df['VOL'])*(1-1/df['LDUR']*(1-np.exp(-df['LDUR'])))
-    df['EFFIN'] = get_random(inhalation_mask_efficiency,num_runs)
-    df['BRFx']   = get_random(breathing_rate_faculty,num_runs)
-    df['BRSx']   = get_random(breathing_rate_student,num_runs)
-    df['BRF']   = 60 * df['BRFx']
-    df['BRS']   = 60 * df['BRSx']
-    df['INF_S'] = df['CONCS'] * df['BRF'] * duration/60 * (1-df['EFFIN'])
-    df['INS_F'] = df['CONCF'] * df['BRS'] * duration/60 * (1-df['EFFIN'])
-    df['INS_S'] = df['CONCS'] * df['BRS'] * duration/60 * (1-df['EFFIN']) 
-    # INECTION PROBABILITIES FOR FACULTY/STUDENT INFECTION
-    df['PF_S']  = df['INFRATES'] * (1 - np.exp(-df['INF_S']))
-    df['PS_F']  = df['INFRATEF'] * (1 - np.exp(-df['INS_F']))
-    df['PS_S']  = df['INFRATES'] * (1 - np.exp(-df['INS_S']))
-    # INFECTION PROBABILITIES FOR 1 CLASS SESSION
-    df['PF'] = 1 - ((1-df['PF_S'])**(num_students))
-    df['PS'] = 1 - (((1-df['PS_S'])**(num_students-1))*((1-df['PS_F'])**(num_faculty)))
-    # INFECTION PROBABILITIES FOR SEMESTER
-    df['nPF'] = 1 - df['PF']
-    df['nPFsemester'] = df['nPF']**num_class_periods
-    df['PFsemester']  = 1 - df['nPFsemester']
-    df['nPS'] = 1 - df['PS']
-    df['nPSsemester'] = df['nPS']**num_class_periods
-    df['PSsemester']  = 1 - df['nPSsemester']
-    return(df)
-
-def update_figure(df,faculty=True):
+@metrics.timed('figure')
+def update_figure(df,faculty=True,stats=None):
+    #Bars from pre-binned counts (summary.describe_outputs) rather than raw samples
+    import plotly.graph_objects as go
     if faculty: fld = 'PFsemester'; txt = 'Faculty'
     else: fld = 'PSsemester'; txt = 'Student'
-    #Get the max x value
-    # x_maxf = df['PFsemester'].max()
-    # x_maxs = df['PSsemester'].max()
-    x_maxf = df['PFsemester'].quantile(0.99)
-    x_maxs = df['PSsemester'].quantile(0.99)
-    x_max = max(x_maxf, x_maxs)
-    #Update the figure
-    fig = px.histogram(df,x=fld,nbins=40,histnorm='percent',
-                       title=f'Calculated Distribution of {txt} Infection Probabilities for Semester<br>from 10,000 Monte Carlo Simulations')
+    #Get the max x value (99th percentile of either output) and the counts
+    if stats is None: stats = describe_outputs(df)
+    fst = stats[fld]
+    x_max = fst['x_max']
+    n = fst['count']
+    edges = fst['edges']
+    #Update the figure (df may be a DataFrame, a ModelResult or a StreamResult)
+    fig = go.Figure(go.Bar(x=(edges[:-1]+edges[1:])/2,
+                           y=100*fst['counts']/n,
+                           width=np.diff(edges)))
+    fig.update_layout(title_text = f'Calculated Distribution of {txt} Infection Probabilities for Semester<br>from {n:,} Monte Carlo Simulations')
     fig.update_xaxes(title_text = 'Probability of infection (%)',
                      range=[0,x_max])
-    fig.update_yaxes(title_text = 'Percentage of 10,000 Monte Carlo cases')
+    fig.update_yaxes(title_text = f'Percentage of {n:,} Monte Carlo cases')
     fig.update_layout(xaxis_tickformat = "%",
                       font_size=10)
     #fig.update_layout(transition_duration=500)
     return(fig)
 
-def summarize_output(df,faculty=True):
-    if faculty: fld = 'PFsemester'; txt = 'FOR FACULTY MEMBER TEACHING THE COURSE'
-    else: fld = 'PSsemester'; txt = 'FOR A STUDENT TAKING THE COURSE'
-    #Create markdown from values
-    the_mean = df[fld].mean()
-    the_quants = [df[fld].quantile(x) for x in (0.05,0.25,0.5,0.75,0.95)]
+def summary_markdown(stats,faculty=True):
+    if faculty: txt = 'FOR FACULTY MEMBER TEACHING THE COURSE'
+    else: txt = 'FOR A STUDENT TAKING THE COURSE'
+    the_mean = stats['mean']
+    the_quants = stats['quantiles']
     #Create Markdown
     md_text=f'''  
 **{txt}**
@@ -120,17 +79,87 @@ def summarize_output(df,faculty=True):
 '''
     return md_text
 
+@metrics.timed('summarize')
+def summarize_output(df,faculty=True):
+    if faculty: fld = 'PFsemester'
+    else: fld = 'PSsemester'
+    #Create markdown from values
+    return summary_markdown(describe(df[fld],QUANTILES),faculty)
+
 def summarize_outputx(df,faculty=True):
     if faculty: fld = 'PFsemester'; txt = ''
     else: fld = 'PSsemester'; txt = ''
     #Create markdown from values
-    the_mean = df[fld].mean()
-    the_quants = [df[fld].quantile(x) for x in (0.05,0.25,0.5,0.75,0.95)]
+    stats = describe(df[fld],QUANTILES)
     #Create Markdown
     md_text=f'''
 '''
     return 
 
+def page_params(sa,ht,nstudents,cduration,cperiods,
+                breath_fmin,breath_fmax,
+                breath_smin,breath_smax,
+                vent_min,vent_max,
+                decay_min,decay_max,
+                depos_min,depos_max,
+                additional_min,additional_max,
+                qfac_min,qfac_max,
+                qstu_min,qstu_max,
+                exmask_min,exmask_max,
+                inmask_min,inmask_max,
+                infectf_min,infectf_max,
+                infects_min,infects_max):
+    #Model keyword arguments from the page inputs (in page_states order)
+    return dict(surface_area=sa,
+                height=ht,
+                num_students=nstudents,
+                duration=cduration,
+                num_class_periods=cperiods,
+                breathing_rate_faculty = [breath_fmin,breath_fmax],
+                breathing_rate_student = [breath_smin,breath_smax],
+                ventilation_w_outside_air = [vent_min,vent_max],
+                decay_rate_of_virus = [decay_min,decay_max],
+                deposition_to_surface = [depos_min,depos_max],
+                additional_control_measures = [additional_min,additional_max],
+                quanta_emission_rate_faculty = [qfac_min,qfac_max],
+                quanta_emission_rate_student = [qstu_min,qstu_max],
+                exhalation_mask_efficiency = [exmask_min/100,exmask_max/100],
+                inhalation_mask_efficiency = [inmask_min/100,inmask_max/100],
+                background_infection_rate_faculty = [infectf_min/100,infectf_max/100],
+                background_infection_rate_student = [infects_min/100,infects_max/100])
+
+def summary_markdowns(result):
+    with metrics.stage('summarize'):
+        stats = describe_outputs(result,QUANTILES)
+    return summary_markdown(stats['PFsemester'],True), summary_markdown(stats['PSsemester'],False)
+
+def stream_summaries(params,seed,job=None):
+    #Large runs in chunks, publishing partial summaries as a job's progress
+    params = dict(params)
+    num_runs = params.pop('num_runs')
+    progress = None if job is None else lambda result,done: job.report(done/num_runs,summary_markdowns(result))
+    result = stream_model(num_runs=num_runs,random_state=np.random.RandomState(seed),
+                          progress=progress,**params)
+    return summary_markdowns(result)
+
+def summarize_sensitivity(table):
+    #Markdown table of Sobol indices, most influential inputs first
+    table = table.sort_values('PFsemester_ST',ascending=False)
+    rows = [f'| {sensitivity.LABELS[name]} | {r.PFsemester_S1:0.0%} | {r.PFsemester_ST:0.0%} | {r.PSsemester_S1:0.0%} | {r.PSsemester_ST:0.0%} |'
+            for name,r in table.clip(0,1).iterrows()
+            if max(r.PFsemester_ST,r.PSsemester_ST) >= 0.005]
+    md_text = '''
+**SHARE OF THE UNCERTAINTY IN SEMESTER INFECTION PROBABILITY DUE TO EACH INPUT**
+
+_Alone_: variance explained by the input by itself (first-order Sobol index).
+_Total_: including its interactions with other inputs (total Sobol index).
+Inputs explaining less than 0.5% are not shown.
+
+| Uncertain input | Faculty: alone | Faculty: total | Student: alone | Student: total |
+| --- | --: | --: | --: | --: |
+''' + '\n'.join(rows) + '\n'
+    return md_text
+
 def update_results(first_click=False):
     if first_click:
         return '### Results will be displayed here'
@@ -140,10 +169,49 @@ def update_results(first_click=False):
     '''
     return md_text
 
-#%%Read in the static data
-df = update_df()
-fig = update_figure(df)
-md_results = summarize_outputx(df)
+#%% Startup
+#Default results are built on first use (or by warm_up) rather than at import
+startup_timings = {}
+_defaults = {}
+
+def default_results():
+    if not _defaults:
+        df = run_model(random_state=np.random.RandomState(0))
+        stats = describe_outputs(df)
+        _defaults.update(df=df,fig=update_figure(df,stats=stats),md_results=summarize_outputx(df))
+    return _defaults
+
+def __getattr__(name):
+    #Lazy module attributes kept for callers of the old wsgi.df/fig/md_results
+    if name in ('df','fig','md_results'):
+        return default_results()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def layout_values(component):
+    #id -> value of every input component in a layout
+    values = {}
+    stack = [component]
+    while stack:
+        c = stack.pop()
+        if isinstance(c,(list,tuple)):
+            stack.extend(c)
+            continue
+        if getattr(c,'id',None) is not None and hasattr(c,'value'):
+            values[c.id] = c.value
+        children = getattr(c,'children',None)
+        if children is not None and not isinstance(children,str):
+            stack.append(children)
+    return values
+
+def warm_up():
+    #Precompute the default page results and compile the model kernel, e.g.
+    #in the gunicorn master with preload_app so forked workers share them
+    #copy-on-write (see config.py)
+    started = time.perf_counter()
+    kernels.warm_up()
+    values = layout_values(app.layout)
+    update_page(0,0,None,None,values['num_runs'],*[values[state.component_id] for state in page_states])
+    startup_timings['warm_up'] = time.perf_counter() - started
 
 #%% Page construction
 #external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -151,6 +219,17 @@ md_results = summarize_outputx(df)
 app = dash.Dash(__name__)#, external_stylesheets=external_stylesheets)
 app.title = "COVID exposure modeler"
 application = app.server 
+results_cache = cache.from_environ()
+sessions = incremental.Sessions(int(os.environ.get('INCREMENTAL_SESSIONS','16')))
+job_queue = jobs.from_environ()
+api.register(application)
+metrics.register(application)
+metrics.REGISTRY.gauge('result_cache_hits_total','Page results served from the result cache',
+                       lambda: results_cache.hits,type='counter')
+metrics.REGISTRY.gauge('result_cache_misses_total','Page results computed',
+                       lambda: results_cache.misses,type='counter')
+metrics.REGISTRY.gauge('result_cache_hit_ratio','Share of page results served from the cache',
+                       lambda: results_cache.hits / max(results_cache.hits + results_cache.misses,1))
 
 #Construct the web site
 app.layout = html.Div([
@@ -355,9 +434,20 @@ dcc.Markdown('''
             html.Td(dcc.Input(id='qstu_min',value=0.69,type='number')),
             html.Td(dcc.Input(id='qstu_max',value=0.71,type='number')),]),
             ]),
-              
+
+    html.Div([
+        html.Label('Number of Monte Carlo scenarios'),
+        dcc.Dropdown(id='num_runs',
+                     options=[{'label':f'{n:,}','value':n} for n in RUN_OPTIONS],
+                     value=RUN_OPTIONS[0],clearable=False,
+                     style={'width':'200px'}),
+        ]),
+    dcc.Store(id='job',storage_type='memory'),
+    dcc.Store(id='user',storage_type='local'),
+    dcc.Interval(id='job-poll',interval=500,disabled=True),
 
     dcc.Markdown(id='results_text'),
+    dcc.Markdown(id='job_status'),
 
     html.Table([
         html.Tr([
@@ -383,17 +473,24 @@ dcc.Markdown('''
         ]),
 
     dcc.Markdown('''
-    **_Since some of the input parameters are uncertain, calculations are perfomed for 10,000 plausible scenarios using random combinations
-    of input parameter values. The results shown above represent statistical summaries from these 10,000 scenarios._**
+    **_Since some of the input parameters are uncertain, calculations are perfomed for many plausible scenarios (10,000 unless chosen
+    otherwise above) using random combinations of input parameter values. The results shown above represent statistical summaries from these scenarios._**
     '''),
 
+    html.Div([
+        html.Button(id='sensitivity-button',n_clicks=0,children='Which uncertain inputs matter most?',
+                    style={'font-size':16,'background-color': '#4CAF50',
+                           'color':'white',
+                           'padding':'10px 20px'}),
+        dcc.Markdown(id='sensitivity_results'),
+        ],style={'border-style':'ridge',
+                 'border-radius': '5px',
+                 'padding':'0.5em'}),
+
     ])
 
-@app.callback([Output('faculty_results','children'),
-               Output('student_results','children'),
-               Output('results_text','children')],
-              [Input('submit-button-state','n_clicks')],
-              [State('surface','value'),
+#%% Callbacks
+page_states = [State('surface','value'),
                State('height','value'),
                State('num_students','value'),
                State('class_duration','value'),
@@ -410,58 +507,94 @@ dcc.Markdown('''
                State('inmask_min','value'),State('inmask_max','value'),
                State('infectf_min','value'),State('infectf_max','value'),
                State('infects_min','value'),State('infects_max','value')]
-)
-def update_page(num_clicks,sa,ht,nstudents,cduration,cperiods,
-                breath_fmin,breath_fmax,
-                breath_smin,breath_smax,
-                vent_min,vent_max,
-                decay_min,decay_max,
-                depos_min,depos_max,
-                additional_min,additional_max,
-                qfac_min,qfac_max,
-                qstu_min,qstu_max,
-                exmask_min,exmask_max,
-                inmask_min,inmask_max,
-                infectf_min,infectf_max,
-                infects_min,infects_max):
-    #Recompute the monte carlo run
-    df = update_df(surface_area=sa,
-                   height=ht,
-                   num_students=nstudents,
-                   duration=cduration,
-                   num_class_periods=cperiods,
-                   breathing_rate_faculty = [breath_fmin,breath_fmax],
-                   breathing_rate_student = [breath_smin,breath_smax],
-                   ventilation_w_outside_air = [vent_min,vent_max],
-                   decay_rate_of_virus = [decay_min,decay_max],
-                   deposition_to_surface = [depos_min,depos_max],
-                   additional_control_measures = [additional_min,additional_max],
-                   quanta_emission_rate_faculty = [qfac_min,qfac_max],
-                   quanta_emission_rate_student = [qstu_min,qstu_max],
-                   exhalation_mask_efficiency = [exmask_min/100,exmask_max/100],
-                   inhalation_mask_efficiency = [inmask_min/100,inmask_max/100],
-                   background_infection_rate_faculty = [infectf_min/100,infectf_max/100],
-                   background_infection_rate_student = [infects_min/100,infects_max/100])
-                   
-    #Get summaries
-    # if num_clicks < 1:
-        # fac_results = summarize_outputx(df,True)
-        # stu_results = summarize_outputx(df,False)
-    # else:
-    fac_results = summarize_output(df,True)
-    stu_results = summarize_output(df,False)
-    #Create histogram
-    # fac_fig = update_figure(df,True)
-    # stu_fig = update_figure(df,False)
-    #return f'Pexp Faculty (Semester): {mean_val:0.2%}',fig
-    # return fac_results,stu_results,fac_fig,stu_fig
+
+@app.callback([Output('faculty_results','children'),
+               Output('student_results','children'),
+               Output('results_text','children'),
+               Output('job_status','children'),
+               Output('job','data'),
+               Output('user','data'),
+               Output('job-poll','disabled')],
+              [Input('submit-button-state','n_clicks'),
+               Input('job-poll','n_intervals')],
+              [State('job','data'),State('user','data'),State('num_runs','value')] + page_states)
+@metrics.timed('callback',callback=True)
+def update_page(num_clicks,num_intervals,job,user,num_runs,*values):
+    job = job or {}
+    user = user or {'id':uuid.uuid4().hex}
+    if num_clicks >= 1 and num_clicks == job.get('clicks'):
+        #Polled by job-poll for the job started by this click
+        return poll_page(job,user)
+    params = dict(page_params(*values),num_runs=num_runs)
+    key = cache.cache_key(params)
+    #Reuse the results if these inputs were seen before, else update this
+    #user's incremental model (small runs) or start a background job. The
+    #incremental models keep every stage array, so without background jobs
+    #large runs are streamed here in bounded chunks instead
+    results = results_cache.get(key)
+    if results is None and num_runs <= SYNC_RUNS:
+        results = summary_markdowns(sessions.evaluate(user['id'],seed=COMMON_SEED,**params))
+        results_cache.set(key,results)
+    elif results is None and job_queue is None:
+        results = stream_summaries(params,COMMON_SEED)
+        results_cache.set(key,results)
     if num_clicks < 1:
-        results_md = update_results(True)
-        fac_results = '',
-        stu_results = ''
-    else:
-        results_md = update_results(False)
-    return fac_results,stu_results, results_md
+        return '','',update_results(True),'',{},user,True
+    if results is not None:
+        if job_queue is not None and job.get('job'): job_queue.cancel(job['job'])
+        fac_results,stu_results = results
+        return fac_results,stu_results,update_results(False),'',{'clicks':num_clicks},user,True
+    def run(task):
+        value = stream_summaries(params,COMMON_SEED,task)
+        results_cache.set(key,value)
+        return value
+    try:
+        task = job_queue.submit(run,user=user['id'],supersedes=job.get('job'))
+    except jobs.JobLimitError as err:
+        return dash.no_update,dash.no_update,dash.no_update,f'**{err}**',{'clicks':num_clicks},user,True
+    job = {'clicks':num_clicks,'job':task.id,'key':key,'num_runs':num_runs,'started':time.time()}
+    return '','',update_results(False),job_progress(0,num_runs),job,user,False
+
+def job_progress(progress,num_runs):
+    return f'_Calculating... {progress:.0%} of {num_runs:,} scenarios done (partial results shown)_'
+
+def poll_page(job,user):
+    #Progress, partial results or final results of a background job
+    unchanged = (dash.no_update,)*3
+    if not job.get('job'):
+        return unchanged + (dash.no_update,job,user,True)
+    task = job_queue.get(job['job']) if job_queue is not None else None
+    if task is None:
+        #Started by another worker process: wait for it in the shared cache
+        results = results_cache.peek(job['key'])
+        if results is not None:
+            return results + (update_results(False),'',job,user,True)
+        if time.time() - job['started'] < JOB_TIMEOUT:
+            return unchanged + ('_Calculating..._',job,user,False)
+        return unchanged + ('**The calculation was interrupted; please click the button again.**',job,user,True)
+    if task.state == 'done':
+        return task.result + (update_results(False),'',job,user,True)
+    if task.state == 'failed':
+        return unchanged + (f'**The calculation failed: {task.error}**',job,user,True)
+    if task.state == 'cancelled':
+        return unchanged + ('',job,user,True)
+    partial = task.partial or ('','')
+    return partial + (update_results(False),job_progress(task.progress,job['num_runs']),job,user,False)
+
+@app.callback(Output('sensitivity_results','children'),
+              [Input('sensitivity-button','n_clicks')],
+              page_states)
+@metrics.timed('sensitivity',callback=True)
+def update_sensitivity(num_clicks,*values):
+    if num_clicks < 1:
+        return ''
+    params = page_params(*values)
+    return results_cache.get_or_compute(
+        dict(params,analysis='sensitivity'),
+        lambda seed: summarize_sensitivity(sensitivity.sobol_indices(
+            num_base=4096,random_state=np.random.default_rng(seed),**params)))
+
+startup_timings['import'] = time.perf_counter() - _import_started
     
 if __name__ == '__main__':
     app.run_server(debug=True)